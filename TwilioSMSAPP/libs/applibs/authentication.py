@@ -1,17 +1,27 @@
 import json
+import os
 from libs.applibs import utils
+from libs.applibs.sender_pool import split_numbers
+from libs.applibs.store import number_key
 from libs.applibs.utils import read_json_file,write_json_file
         
 def signup(
     username,password,
     account_sid,auth_token,phone_num) -> str:
 
+    # phone_num may hold several comma separated sending numbers,
+    # the first one stays the default sender
+    phone_pool = split_numbers(phone_num)
+    if not phone_pool:
+        return False,"Enter a Twilio phone number."
+
     DATA = {
         "username" : username,
         "password" : password,
         "account_sid" : account_sid,
         "auth_token" : auth_token,
-        "phone_num" : phone_num
+        "phone_num" : phone_pool[0],
+        "phone_pool" : phone_pool
     }
 
     FileData = read_json_file(utils.AuthDataFile)
@@ -26,6 +36,52 @@ def signup(
     return True,"Account created."
 
 
+
+def add_sender_numbers(username,numbers):
+    """Add sending numbers to the user's phone pool."""
+    FileData = read_json_file(utils.AuthDataFile)
+    if FileData == 0 or username not in FileData:
+        return False,"User not found."
+
+    user = FileData[username]
+    phone_pool = user.get("phone_pool") or [user["phone_num"]]
+    for number in split_numbers(numbers):
+        if number not in phone_pool:
+            phone_pool.append(number)
+    user["phone_pool"] = phone_pool
+
+    write_json_file(Filename=utils.AuthDataFile,data= FileData)
+    if utils.ActiveUserData.get("username") == username:
+        utils.ActiveUserData["phone_pool"] = phone_pool
+    return True,"Sender numbers saved."
+
+
+_owners = (None, dict(), dict())
+
+
+def owner_of(number, account_sid=None):
+    """
+    Username of the account a message to our `number` belongs to (by its
+    phone pool, else by `account_sid`). The auth file is read again only
+    when it changes, inbound webhooks call this for every message.
+    """
+    global _owners
+    try:
+        mtime = os.stat(utils.AuthDataFile).st_mtime_ns
+    except OSError:
+        return None
+    if _owners[0] != mtime:
+        by_number, by_account = dict(), dict()
+        FileData = read_json_file(utils.AuthDataFile)
+        if FileData != 0:
+            for username, user in FileData.items():
+                for phone in user.get("phone_pool") or [user.get("phone_num")]:
+                    if phone:
+                        by_number[number_key(phone)] = username
+                by_account.setdefault(user.get("account_sid"), username)
+        _owners = (mtime, by_number, by_account)
+    return _owners[1].get(number_key(number)) or _owners[2].get(account_sid)
+
     
 def login(username,password):
     FileData = read_json_file(utils.AuthDataFile)
@@ -0,0 +1,168 @@
+import datetime
+import hashlib
+import itertools
+import json
+import os
+import uuid
+
+from libs.applibs import utils
+from libs.applibs.recipients import PackedNumberSet, RecipientReader
+from libs.applibs.send_log import SendLogReader
+
+
+def campaign_dir():
+    return os.path.join(utils.FolderPath, "campaigns")
+
+
+def file_fingerprint(path):
+    """Size, mtime and a hash of the first 64 KB: enough to notice edits."""
+    stat = os.stat(path)
+    with open(path, "rb") as filedata:
+        head = hashlib.sha1(filedata.read(1 << 16)).hexdigest()
+    return {"path": path, "size": stat.st_size,
+            "mtime": stat.st_mtime_ns, "head": head}
+
+
+class Campaign:
+    """
+    One bulk send with a persisted checkpoint, so a stopped or crashed
+    campaign continues where it was instead of from the top.
+
+    The checkpoint (`<id>.json`) keeps the input fingerprints, the reader
+    position, the numbers that were in flight and the send log offset at
+    that moment; `<id>.seen` keeps the recipient dedupe set.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        # totals of earlier runs, this run's engine summary is added on top
+        self._base_sent = data["sent"]
+        self._base_failed = data["failed"]
+
+    @property
+    def id(self):
+        return self.data["id"]
+
+    @property
+    def message(self):
+        return self.data["message"]
+
+    @property
+    def paths(self):
+        return [saved["path"] for saved in self.data["files"]]
+
+    @property
+    def status(self):
+        return self.data["status"]
+
+    @classmethod
+    def new(cls, username, message, paths, server_url=None):
+        time = datetime.datetime.now()
+        return cls({
+            "id": time.strftime("%Y%m%d%H%M%S-") + uuid.uuid4().hex[:6],
+            "username": username,
+            "message": message,
+            "server_url": server_url,
+            "files": [file_fingerprint(path) for path in paths],
+            "status": "running",
+            "position": [0, 0],
+            "pending": [],
+            "log_offset": 0,
+            "sent": 0,
+            "failed": 0,
+            "total": None,
+            "DateTime": str(time),
+        })
+
+    @classmethod
+    def load(cls, campaign_id):
+        with open(cls._path(campaign_id, ".json"), encoding="utf-8") as jsonFile:
+            return cls(json.load(jsonFile))
+
+    @classmethod
+    def resumable(cls, username):
+        """Unfinished campaigns of `username`, newest first."""
+        campaigns = list()
+        try:
+            names = sorted(os.listdir(campaign_dir()), reverse=True)
+        except FileNotFoundError:
+            return campaigns
+        for name in names:
+            if name.endswith(".json"):
+                campaign = cls.load(name[:-len(".json")])
+                if (campaign.data["username"] == username and
+                        campaign.status != "done"):
+                    campaigns.append(campaign)
+        return campaigns
+
+    @staticmethod
+    def _path(campaign_id, suffix):
+        return os.path.join(campaign_dir(), campaign_id + suffix)
+
+    def saved(self):
+        """True once a checkpoint of this campaign was written."""
+        return os.path.exists(self._path(self.id, ".json"))
+
+    def changed_files(self):
+        """Input files that are missing or differ from the fingerprint."""
+        changed = list()
+        for saved in self.data["files"]:
+            try:
+                if file_fingerprint(saved["path"]) != saved:
+                    changed.append(saved["path"])
+            except OSError:
+                changed.append(saved["path"])
+        return changed
+
+    def reader(self):
+        """`RecipientReader` positioned after the last checkpoint."""
+        seen = None
+        if os.path.exists(self._path(self.id, ".seen")):
+            seen = PackedNumberSet.load(self._path(self.id, ".seen"))
+        reader = RecipientReader(self.paths, self.data["position"], seen)
+        if self.data["total"] is None:
+            self.data["total"] = reader.count()
+        return reader
+
+    def recipients(self, reader, log_path):
+        """
+        Numbers still to send: the ones in flight at the checkpoint first,
+        then the rest of `reader`. Numbers the send log shows as accepted
+        after the checkpoint (sent just before a crash) are skipped; only
+        the log tail written since the checkpoint is read.
+        """
+        tail = SendLogReader(log_path, offset=self.data["log_offset"])
+        accepted = {record["Number"] for record in tail.read_new()
+                    if record.get("Campaign") == self.id}
+        self._base_sent += len(accepted)
+        pending = [number for number in self.data["pending"]
+                   if number not in accepted]
+        if not accepted:
+            return itertools.chain(pending, reader)
+        return itertools.chain(
+            pending, (number for number in reader if number not in accepted))
+
+    def checkpoint(self, reader, pending, summary, log_offset, status="running"):
+        """
+        Persist progress. Call with sends paused between reading the next
+        recipient and finishing in-flight ones (see `SendEngine.checkpoint`).
+        """
+        os.makedirs(campaign_dir(), exist_ok=True)
+        self.data.update({
+            "status": status,
+            "position": list(reader.position),
+            "pending": sorted(pending),
+            "log_offset": log_offset,
+            "sent": self._base_sent + summary.sent,
+            "failed": self._base_failed + summary.failed,
+        })
+        seen_path = self._path(self.id, ".seen")
+        reader.seen.save(seen_path + ".tmp")
+        os.replace(seen_path + ".tmp", seen_path)
+
+        json_path = self._path(self.id, ".json")
+        with open(json_path + ".tmp", "w", encoding="utf-8") as jsonFile:
+            json.dump(self.data, jsonFile)
+            jsonFile.flush()
+            os.fsync(jsonFile.fileno())
+        os.replace(json_path + ".tmp", json_path)
@@ -0,0 +1,147 @@
+import json
+import logging
+import queue
+import threading
+import urllib.request
+
+log = logging.getLogger(__name__)
+
+# topics
+LOGIN = "login"                    # (username)
+COMMITTED = "committed"            # (messages, statuses, seqs) a store write batch committed
+MESSAGE_SENT = "message_sent"      # (messages) sent reports stored
+MESSAGE_RECEIVED = "message_received"  # (messages) inbound messages stored
+STATUS_CHANGED = "status_changed"  # (statuses) status callbacks that moved a message
+PROGRESS = "progress"              # (percent, stats) campaign progress
+REMOTE_COMMIT = "remote_commit"    # () a callback server in another process committed
+
+
+class EventBus:
+    """
+    In-process publish/subscribe. Callbacks run on the publishing thread,
+    so screens hop to the Kivy thread themselves (a Clock trigger). A
+    failing callback is logged and doesn't stop the others or the
+    publisher (the store writer, a send thread).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = dict()
+
+    def subscribe(self, topic, callback):
+        with self._lock:
+            self._subscribers.setdefault(topic, []).append(callback)
+
+    def unsubscribe(self, topic, callback):
+        with self._lock:
+            callbacks = self._subscribers.get(topic, [])
+            if callback in callbacks:
+                callbacks.remove(callback)
+
+    def publish(self, topic, *args):
+        with self._lock:
+            callbacks = list(self._subscribers.get(topic, ()))
+        for callback in callbacks:
+            try:
+                callback(*args)
+            except Exception:
+                log.exception("%s subscriber failed", topic)
+
+
+Bus = EventBus()
+
+
+class EventQueue:
+    """
+    Subscription of one `/events` client of the callback server: topics
+    are put on a bounded queue and dropped when the client falls behind
+    (it rereads the store anyway).
+    """
+
+    def __init__(self, topics, bus=None, maxsize=1000):
+        self.bus = bus or Bus
+        self.topics = topics
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.closed = False
+        self._callbacks = {topic: self._callback(topic) for topic in topics}
+        for topic, callback in self._callbacks.items():
+            self.bus.subscribe(topic, callback)
+
+    def _callback(self, topic):
+        def put(*args):
+            try:
+                self.queue.put_nowait(topic)
+            except queue.Full:
+                pass
+        return put
+
+    def get(self, timeout=None):
+        """Next topic, or None after `timeout` seconds without one."""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        for topic, callback in self._callbacks.items():
+            self.bus.unsubscribe(topic, callback)
+        self.closed = True
+        try:
+            # wake up a waiting `get`
+            self.queue.put_nowait(None)
+        except queue.Full:
+            pass
+
+
+class EventStream:
+    """
+    Client of the callback server's `/events` stream (server-sent events),
+    for when the server runs as its own process: every event it sends is
+    published here as REMOTE_COMMIT. Reconnects after `retry` seconds.
+    """
+
+    def __init__(self, url, bus=None, retry=5):
+        self.url = url
+        self.bus = bus or Bus
+        self.retry = retry
+        self.connected = False
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="events", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._closed.set()
+
+    def _run(self):
+        while not self._closed.is_set():
+            try:
+                with urllib.request.urlopen(self.url) as stream:
+                    self.connected = True
+                    for line in stream:
+                        if self._closed.is_set():
+                            return
+                        if line.startswith(b"data:"):
+                            self.bus.publish(REMOTE_COMMIT)
+            except OSError:
+                pass
+            self.connected = False
+            self._closed.wait(self.retry)
+
+
+def sse_stream(events, heartbeat=15):
+    """Server-sent events for the topics of an EventQueue (a WSGI body)."""
+    try:
+        yield ": connected\n\n"
+        while not events.closed:
+            topic = events.get(timeout=heartbeat)
+            if events.closed:
+                break
+            if topic is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield "data: " + json.dumps({"topic": topic}) + "\n\n"
+    finally:
+        events.close()
@@ -0,0 +1,156 @@
+import logging
+import queue
+import threading
+import time
+
+from libs.applibs import utils, events
+from libs.applibs.store import get_store
+
+log = logging.getLogger(__name__)
+
+
+class Overloaded(Exception):
+    """The write queue is full; the caller should ask the sender to retry."""
+
+
+class PersistenceService:
+    """
+    The one thread that writes to the store. The send threads, the Outbox
+    and the webhook server only put events on a queue; the writer takes
+    everything waiting, up to `batch_size` events or `batch_interval`
+    seconds after the first one, and commits it as one transaction.
+
+    The queue holds at most `max_queue` events. Messages from the send
+    threads wait for room; webhook events never wait, `add_status` (and
+    `add_message(block=False)`) raise Overloaded instead so the webhook
+    can answer 503 right away.
+
+    Every commit is published as `events.COMMITTED` on the writer thread
+    with `(messages, statuses, seqs)`: [(report, username)], [status
+    report] and the seq range of the messages (see `Store.write_batch`).
+    """
+
+    def __init__(self, store=None, batch_size=None, batch_interval=None, max_queue=None):
+        self.store = store or get_store()
+        self.batch_size = batch_size or utils.PersistBatchSize
+        self.batch_interval = batch_interval or utils.PersistBatchInterval
+        self.queue = queue.Queue(maxsize=max_queue or utils.PersistQueueSize)
+        self.rejected = 0
+        self.failed = 0
+        self.batches = 0
+        self.events = 0
+        self.last_batch_size = 0
+        self.max_batch_size = 0
+        self.commit_time = 0.0
+        self.max_commit_time = 0.0
+        self._thread = threading.Thread(target=self._run, name="persistence", daemon=True)
+        self._thread.start()
+
+    def add_message(self, report, username, block=True):
+        self._put(("message", report, username), block)
+
+    def add_status(self, report):
+        self._put(("status", report, None), False)
+
+    def _put(self, event, block):
+        try:
+            self.queue.put(event, block)
+        except queue.Full:
+            self.rejected += 1
+            raise Overloaded("persistence queue is full") from None
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue.qsize(),
+            "queue_size": self.queue.maxsize,
+            "rejected": self.rejected,
+            "failed": self.failed,
+            "batches": self.batches,
+            "events": self.events,
+            "last_batch_size": self.last_batch_size,
+            "avg_batch_size": round(self.events / self.batches, 1) if self.batches else 0,
+            "max_batch_size": self.max_batch_size,
+            "avg_commit_ms": round(self.commit_time / self.batches * 1000, 3) if self.batches else 0,
+            "max_commit_ms": round(self.max_commit_time * 1000, 3),
+        }
+
+    def flush(self, timeout=None):
+        """Wait until everything queued so far is committed."""
+        done = threading.Event()
+        self.queue.put(("flush", done, None))
+        return done.wait(timeout)
+
+    def close(self):
+        self.queue.put(("stop", None, None))
+        self._thread.join()
+
+    def _next_batch(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.batch_interval
+        while len(batch) < self.batch_size and batch[-1][0] not in ("flush", "stop"):
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            messages = [(report, username) for kind, report, username in batch if kind == "message"]
+            statuses = [report for kind, report, _ in batch if kind == "status"]
+            if messages or statuses:
+                self._commit(messages, statuses)
+            for kind, item, _ in batch:
+                if kind == "flush":
+                    item.set()
+                elif kind == "stop":
+                    return
+
+    def _commit(self, messages, statuses):
+        # a failed batch (database locked by another process past the
+        # timeout, disk full ...) is logged and dropped: the writer has to
+        # keep running or every producer ends up blocked on a full queue
+        started = time.perf_counter()
+        try:
+            seqs = self.store.write_batch(messages, statuses)
+        except Exception:
+            self.failed += len(messages) + len(statuses)
+            log.exception("store write of %d events failed", len(messages) + len(statuses))
+            return
+        self._record(len(messages) + len(statuses), time.perf_counter() - started)
+        try:
+            events.Bus.publish(events.COMMITTED, messages, statuses, seqs)
+        except Exception:
+            log.exception("COMMITTED subscriber failed")
+
+    def _record(self, size, seconds):
+        self.batches += 1
+        self.events += size
+        self.last_batch_size = size
+        self.max_batch_size = max(self.max_batch_size, size)
+        self.commit_time += seconds
+        self.max_commit_time = max(self.max_commit_time, seconds)
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_service():
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = PersistenceService()
+        return _service
+
+
+def stop_service():
+    global _service
+    with _service_lock:
+        if _service is not None:
+            _service.close()
+            _service = None
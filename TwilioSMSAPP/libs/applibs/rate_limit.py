@@ -0,0 +1,100 @@
+import threading
+import time
+
+from libs.applibs import utils
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at `rate` tokens per second, holding at most
+    `burst` tokens. `reserve()` always takes a token and returns how long
+    the caller has to wait for it, so waiting threads queue up fairly
+    instead of spinning.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def configure(self, rate, burst=None):
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = float(rate)
+            self.burst = float(burst or rate)
+            self.tokens = min(self.tokens, self.burst)
+
+
+class RateLimiter:
+    """
+    Buckets keyed by sending number and by account sid. Limits come from
+    `utils.SenderMPS` / `utils.AccountMPS` and fall back to the defaults.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = dict()
+
+    def _limit(self, kind, key):
+        if kind == "from":
+            rate, burst = utils.SenderMPS.get(
+                key, (utils.DefaultSenderMPS, utils.DefaultSenderBurst))
+        else:
+            rate, burst = utils.AccountMPS.get(
+                key, (utils.DefaultAccountMPS, utils.DefaultAccountBurst))
+        return rate, burst
+
+    def bucket(self, kind, key):
+        with self._lock:
+            bucket = self._buckets.get((kind, key))
+            if bucket is None:
+                rate, burst = self._limit(kind, key)
+                if not rate:
+                    return None
+                bucket = self._buckets[(kind, key)] = TokenBucket(rate, burst)
+            return bucket
+
+    def configure(self, kind, key, rate, burst=None):
+        """Change the MPS limit of one sender ("from") or account ("account")."""
+        limits = utils.SenderMPS if kind == "from" else utils.AccountMPS
+        limits[key] = (rate, burst or rate)
+        with self._lock:
+            if not rate:
+                # no limit: drop the bucket, `bucket()` won't make a new one
+                self._buckets.pop((kind, key), None)
+                return
+            bucket = self._buckets.get((kind, key))
+            if bucket is not None:
+                bucket.configure(rate, burst)
+
+    def delay(self, account_sid, from_):
+        """Reserve a send for this account and number, return seconds to wait."""
+        wait = 0.0
+        for kind, key in (("account", account_sid), ("from", from_)):
+            bucket = self.bucket(kind, key)
+            if bucket is not None:
+                wait = max(wait, bucket.reserve())
+        return wait
+
+    def acquire(self, account_sid, from_):
+        """Block until this account and number are allowed to send."""
+        wait = self.delay(account_sid, from_)
+        if wait > 0:
+            time.sleep(wait)
+
+
+Limiter = RateLimiter()
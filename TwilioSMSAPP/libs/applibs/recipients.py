@@ -0,0 +1,177 @@
+from array import array
+
+
+def normalize_number(text):
+    """
+    ' +1 (555) 010-9999\\n' -> '+15550109999'
+    Returns None when the line is not a phone number.
+    """
+    text = str(text).strip().lstrip("\ufeff")
+    plus = text.startswith("+")
+    digits = "".join(ch for ch in text if ch not in " -().\t")
+    if plus:
+        digits = digits[1:]
+    # isdigit() alone also takes "²" and other digits int() refuses
+    if not (digits.isascii() and digits.isdigit()) or len(digits) > 15:
+        return None
+    return "+" + digits if plus else digits
+
+
+def pack_number(number):
+    """
+    Normalized number -> one 64 bit int. Length and the "+" prefix are
+    packed above the digits so "0123" and "123" stay different keys.
+    """
+    plus = number.startswith("+")
+    digits = number[1:] if plus else number
+    return (plus << 55) | (len(digits) << 50) | int(digits)
+
+
+def unpack_number(key):
+    digits = str(key & ((1 << 50) - 1)).zfill((key >> 50) & 0x1F)
+    return "+" + digits if key >> 55 else digits
+
+
+class PackedNumberSet:
+    """
+    Set of packed numbers stored in one flat `array('Q')` hash table
+    (8 bytes per slot) instead of a Python set of str objects, so
+    deduping millions of recipients stays compact.
+    """
+
+    _EMPTY = 0
+    _MULT = 0x9E3779B97F4A7C15
+    _MASK64 = (1 << 64) - 1
+
+    def __init__(self, capacity=1024):
+        size = 16
+        while size < capacity * 2:
+            size <<= 1
+        self._slots = array("Q", bytes(8 * size))
+        self._used = 0
+
+    def __len__(self):
+        return self._used
+
+    def _home(self, key, mask):
+        return ((key * self._MULT) & self._MASK64) >> 32 & mask
+
+    def _index(self, key, slots):
+        mask = len(slots) - 1
+        i = self._home(key, mask)
+        while True:
+            slot = slots[i]
+            if slot == key or slot == self._EMPTY:
+                return i
+            i = (i + 1) & mask
+
+    def __contains__(self, key):
+        return self._slots[self._index(key, self._slots)] == key
+
+    def add(self, key):
+        """Add `key`, return False when it was already there."""
+        i = self._index(key, self._slots)
+        if self._slots[i] == key:
+            return False
+        self._slots[i] = key
+        self._used += 1
+        if self._used * 2 > len(self._slots):
+            self._grow()
+        return True
+
+    def discard(self, key):
+        """Remove `key`, return False when it was not there."""
+        slots = self._slots
+        mask = len(slots) - 1
+        i = self._index(key, slots)
+        if slots[i] != key:
+            return False
+        # backward shift: move later keys of the probe run into the hole
+        j = i
+        while True:
+            j = (j + 1) & mask
+            if slots[j] == self._EMPTY:
+                break
+            home = self._home(slots[j], mask)
+            if (i < j and (home <= i or home > j)) or (j < i and home <= i and home > j):
+                slots[i] = slots[j]
+                i = j
+        slots[i] = self._EMPTY
+        self._used -= 1
+        return True
+
+    def __iter__(self):
+        return (key for key in self._slots if key != self._EMPTY)
+
+    def save(self, path):
+        with open(path, "wb") as setfile:
+            self._slots.tofile(setfile)
+
+    @classmethod
+    def load(cls, path):
+        numbers = cls(0)
+        slots = array("Q")
+        with open(path, "rb") as setfile:
+            slots.frombytes(setfile.read())
+        numbers._slots = slots
+        numbers._used = len(slots) - slots.count(cls._EMPTY)
+        return numbers
+
+    def _grow(self):
+        old = self._slots
+        slots = array("Q", bytes(8 * len(old) * 2))
+        for key in old:
+            if key != self._EMPTY:
+                slots[self._index(key, slots)] = key
+        self._slots = slots
+
+
+class RecipientReader:
+    """
+    Stream normalized recipients out of the selected files in file order,
+    skipping blank/invalid lines and duplicates across all files.
+
+    `position` is (file index, byte offset) of the next unread line; pass
+    it back with the `seen` set to continue reading where it stopped.
+    """
+
+    def __init__(self, paths, position=(0, 0), seen=None):
+        self.paths = list(paths)
+        self.position = tuple(position)
+        self.seen = seen if seen is not None else PackedNumberSet()
+        self.duplicates = 0
+        self.invalid = 0
+
+    def count(self):
+        """Number of lines in all files (upper bound of the recipients)."""
+        total = 0
+        for path in self.paths:
+            last = b"\n"
+            with open(path, "rb") as filedata:
+                for chunk in iter(lambda: filedata.read(1 << 20), b""):
+                    total += chunk.count(b"\n")
+                    last = chunk[-1:]
+            if last != b"\n":
+                total += 1
+        return total
+
+    def __iter__(self):
+        start, offset = self.position
+        for index in range(start, len(self.paths)):
+            with open(self.paths[index], "rb") as filedata:
+                filedata.seek(offset)
+                for line in filedata:
+                    offset += len(line)
+                    self.position = (index, offset)
+                    line = line.decode("utf-8", errors="replace")
+                    number = normalize_number(line)
+                    if number is None:
+                        if line.strip():
+                            self.invalid += 1
+                        continue
+                    if not self.seen.add(pack_number(number)):
+                        self.duplicates += 1
+                        continue
+                    yield number
+            offset = 0
+            self.position = (index + 1, 0)
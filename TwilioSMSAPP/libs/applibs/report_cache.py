@@ -0,0 +1,162 @@
+import collections
+import os
+import threading
+
+from libs.applibs import utils, events
+from libs.applibs.store import get_store, number_key, status_report
+
+
+class ReportCache:
+    """
+    In-memory view of the user's latest conversations (at most
+    `ReportCacheSize`, newest first), loaded from the store once and
+    then kept up to date, and the source of change notifications:
+
+        * commits of this process arrive from the `PersistenceService`;
+        * commits of another process (a standalone callback server) are
+          announced by its `/events` stream (REMOTE_COMMIT) or noticed by
+          the database files' mtime, and read incrementally (messages
+          after the last seq, status events after the last id). The
+          mtime is only polled when the server isn't embedded.
+
+    What changed is published on `events.Bus` as MESSAGE_SENT and
+    MESSAGE_RECEIVED (the user's outbound and inbound messages) and
+    STATUS_CHANGED (status callbacks, the store decides whether they move
+    a message), on a background thread. `generation` changes when the
+    view was loaded again from the start (the store was cleared).
+    """
+
+    def __init__(self, username, store=None):
+        self.username = username
+        self.store = store or get_store()
+        self.generation = 0
+        self._lock = threading.RLock()
+        self._load()
+        events.Bus.subscribe(events.COMMITTED, self._on_commit)
+        events.Bus.subscribe(events.REMOTE_COMMIT, self.refresh)
+        self._closed = threading.Event()
+        if not utils.EmbeddedServer:
+            self._watcher = threading.Thread(target=self._watch, daemon=True)
+            self._watcher.start()
+
+    def _load(self):
+        with self._lock:
+            self._mtime = self._db_mtime()
+            self._event_id = self.store.last_event_id()
+            self._seq = self.store.last_seq()
+            # seq ranges of our own commits above `_seq`, already notified
+            self._own = list()
+            threads = list()
+            if self.username:
+                threads, _ = self.store.threads(self.username, limit=utils.ReportCacheSize)
+            # number key -> latest message, newest first
+            self._threads = collections.OrderedDict(
+                (number_key(thread["Number"]), thread) for thread in threads)
+            self.generation += 1
+
+    def close(self):
+        self._closed.set()
+        events.Bus.unsubscribe(events.COMMITTED, self._on_commit)
+        events.Bus.unsubscribe(events.REMOTE_COMMIT, self.refresh)
+
+    # -- reads
+
+    def threads(self):
+        """Latest conversations: [{"Number", "Message", "Direction", "TimeStamp"}]"""
+        with self._lock:
+            return list(self._threads.values())
+
+    def _apply(self, messages):
+        with self._lock:
+            for report in sorted(messages, key=lambda report: report.get("TimeStamp") or 0):
+                key = number_key(report.get("Number"))
+                if key is None:
+                    continue
+                current = self._threads.get(key)
+                if current is not None and (current["TimeStamp"] or 0) > (report.get("TimeStamp") or 0):
+                    continue
+                self._threads[key] = {
+                    "Number": report["Number"],
+                    "Message": report.get("Message"),
+                    "Direction": report.get("Direction") or "outbound",
+                    "TimeStamp": report.get("TimeStamp"),
+                }
+                self._threads.move_to_end(key, last=False)
+            while len(self._threads) > utils.ReportCacheSize:
+                self._threads.popitem()
+
+    # -- change notifications
+
+    def _notify(self, messages, statuses):
+        sent = [report for report in messages if report.get("Direction") != "inbound"]
+        received = [report for report in messages if report.get("Direction") == "inbound"]
+        if sent:
+            events.Bus.publish(events.MESSAGE_SENT, sent)
+        if received:
+            events.Bus.publish(events.MESSAGE_RECEIVED, received)
+        if statuses:
+            events.Bus.publish(events.STATUS_CHANGED, statuses)
+
+    def _on_commit(self, messages, statuses, seqs=None):
+        with self._lock:
+            # our own commit, not a reason to reread the files
+            self._mtime = self._db_mtime()
+            if seqs is not None:
+                if seqs[0] == self._seq:
+                    self._seq = seqs[1]
+                else:
+                    # another process committed in between, `refresh` reads it
+                    self._own.append(seqs)
+        messages = [report for report, username in messages if username == self.username]
+        self._apply(messages)
+        self._notify(messages, [status_report(report) for report in statuses])
+
+    # -- changes from other processes
+
+    def _db_mtime(self):
+        mtime = 0
+        for path in (self.store.path, self.store.path + "-wal"):
+            try:
+                mtime = max(mtime, os.stat(path).st_mtime_ns)
+            except OSError:
+                pass
+        return mtime
+
+    def refresh(self):
+        """Read what other processes committed since the last refresh."""
+        with self._lock:
+            if self._db_mtime() == self._mtime:
+                return
+            self._mtime = self._db_mtime()
+            messages = list()
+            if self.username:
+                seq, messages = self.store.messages_after(self.username, self._seq, self._own)
+                self._seq = max([seq] + [upto for after, upto in self._own])
+            self._own = list()
+            self._event_id, statuses = self.store.status_events_after(self._event_id)
+        self._apply(messages)
+        self._notify(messages, statuses)
+
+    def invalidate(self):
+        """Load again from the store (e.g. after clearing it)."""
+        self._load()
+
+    def _watch(self):
+        while not self._closed.wait(utils.CacheCheckInterval):
+            self.refresh()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Cache of the logged in user, made again when the user changes."""
+    global _cache
+    username = utils.ActiveUserData.get("username")
+    with _cache_lock:
+        if _cache is None or _cache.username != username:
+            if _cache is not None:
+                _cache.close()
+            _cache = ReportCache(username)
+        return _cache
@@ -0,0 +1,148 @@
+import datetime
+import heapq
+import itertools
+import json
+import os
+import random
+import threading
+import time
+
+from twilio.base.exceptions import TwilioRestException
+
+from libs.applibs import utils
+
+# Twilio error codes worth trying again: rate limits and queue overflow
+RETRY_CODES = {20429, 30001}
+# "Attempt to send to unsubscribed recipient"
+OPTED_OUT_CODE = 21610
+
+
+def is_retryable(error):
+    """True for 429, 5xx and network errors, False for permanent errors."""
+    if isinstance(error, TwilioRestException):
+        return (error.status == 429 or error.status >= 500 or
+                error.code in RETRY_CODES)
+    # imported here, requests is only loaded once something is sent
+    from requests.exceptions import ConnectionError, Timeout
+    return isinstance(error, (ConnectionError, Timeout))
+
+
+def is_throttled(error):
+    """The API asked us to slow down (429 / 503)."""
+    return (isinstance(error, TwilioRestException) and
+            (error.status in (429, 503) or error.code == 20429))
+
+
+def is_opted_out(error):
+    """The recipient replied STOP, Twilio refuses to send to it."""
+    return isinstance(error, TwilioRestException) and error.code == OPTED_OUT_CODE
+
+
+def backoff(attempt):
+    """Exponential backoff with full jitter for retry number `attempt` (1..)."""
+    cap = min(utils.RetryMaxDelay, utils.RetryBaseDelay * 2 ** (attempt - 1))
+    return random.uniform(0, cap)
+
+
+class RetryScheduler:
+    """
+    Delay heap of failed sends. A single thread hands every item back to
+    `submit(item, attempt)` once its delay is over, so waiting retries
+    never hold a send worker.
+    """
+
+    def __init__(self, submit):
+        self.submit = submit
+        self._heap = list()
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def __len__(self):
+        with self._cond:
+            return len(self._heap)
+
+    def schedule(self, item, attempt, delay):
+        with self._cond:
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._seq), item, attempt))
+            self._cond.notify()
+
+    def clear(self):
+        """Drop every waiting retry and return their items."""
+        with self._cond:
+            items = [entry[2] for entry in self._heap]
+            self._heap.clear()
+            return items
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed:
+                    if self._heap and self._heap[0][0] <= time.monotonic():
+                        break
+                    timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+                    self._cond.wait(timeout)
+                if self._closed:
+                    return
+                _, _, item, attempt = heapq.heappop(self._heap)
+            self.submit(item, attempt)
+
+
+class DeadLetterStore:
+    """
+    JSON Lines file of sends that failed for good, kept so they can be
+    queued again later with `take()`.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def add(self, number, message, error, attempts, campaign_id=None):
+        time = datetime.datetime.now()
+        record = {
+            "DateTime": str(time),
+            "TimeStamp": time.timestamp(),
+            "Number": number,
+            "Message": message,
+            "Campaign": campaign_id,
+            "Attempts": attempts,
+            "Status": getattr(error, "status", None),
+            "Code": getattr(error, "code", None),
+            "Error": str(getattr(error, "msg", "") or error),
+        }
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as deadfile:
+                deadfile.write(json.dumps(record) + "\n")
+
+    def read(self):
+        try:
+            with open(self.path, encoding="utf-8") as deadfile:
+                return [json.loads(line) for line in deadfile if line.strip()]
+        except FileNotFoundError:
+            return list()
+
+    def take(self, message=None):
+        """
+        Remove and return the dead letters of `message` (all of them when
+        None); the others stay in the store.
+        """
+        with self._lock:
+            taken, kept = list(), list()
+            for record in self.read():
+                if message is None or record["Message"] == message:
+                    taken.append(record)
+                else:
+                    kept.append(record)
+            with open(self.path + ".tmp", "w", encoding="utf-8") as deadfile:
+                deadfile.writelines(json.dumps(record) + "\n" for record in kept)
+            os.replace(self.path + ".tmp", self.path)
+            return taken
@@ -0,0 +1,306 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from libs.applibs import utils, twilio_api, retry, rate_limit
+
+log = logging.getLogger(__name__)
+
+
+class CampaignSummary:
+    """Counters of one bulk send, filled in while the engine runs."""
+
+    def __init__(self):
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.suppressed = 0
+        self.started = None
+        self.finished = None
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def rate(self):
+        """Achieved messages per second."""
+        elapsed = self.elapsed
+        return self.sent / elapsed if elapsed > 0 else 0.0
+
+    def as_dict(self):
+        return {
+            "Sent": self.sent,
+            "Failed": self.failed,
+            "Retried": self.retried,
+            "Suppressed": self.suppressed,
+            "Elapsed": round(self.elapsed, 3),
+            "MsgPerSec": round(self.rate, 2),
+        }
+
+    def __str__(self):
+        return (f"Sent {self.sent}, Failed {self.failed}, Opted out {self.suppressed} in "
+                f"{self.elapsed:.1f}s ({self.rate:.1f} msg/s)")
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class AIMDController:
+    """
+    In-flight limit for the send workers that adapts to the API.
+
+    Every `AimdWindow` seconds it looks at the latencies of
+    `messages.create` and the throttled (429/503) responses of that window:
+        * any throttling: limit * AimdBackoff
+        * p95 above AimdLatencyTolerance x the best p50 seen: limit * 0.9
+        * otherwise, if the limit was actually reached: limit + 1
+
+    A slot is taken with `acquire` before a send is queued, but only
+    counts as in flight (for the limit being reached) from `begin`, once
+    the rate limiter let it through, so sends waiting for a token don't
+    look like API saturation.
+    """
+
+    def __init__(self, initial=None, minimum=None, maximum=None):
+        self.minimum = minimum or utils.SendConcurrencyMin
+        self.maximum = maximum or utils.SendConcurrencyMax
+        self.limit = float(min(max(initial or utils.SendConcurrency, self.minimum), self.maximum))
+        self.slots = 0
+        self.inflight = 0
+        self.decision = "start"
+        self.p50 = self.p95 = None
+        self.best_p50 = None
+        self._latencies = list()
+        self._throttled = 0
+        self._saturated = False
+        self._window_start = time.monotonic()
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.slots >= int(self.limit):
+                self._cond.wait()
+            self.slots += 1
+
+    def begin(self):
+        """The API request of an acquired slot starts."""
+        with self._cond:
+            self.inflight += 1
+            if self.inflight >= int(self.limit):
+                self._saturated = True
+
+    def release(self, latency=None, throttled=False, started=True):
+        with self._cond:
+            self.slots -= 1
+            if started:
+                self.inflight -= 1
+            if latency is not None:
+                self._latencies.append(latency)
+            if throttled:
+                self._throttled += 1
+            if time.monotonic() - self._window_start >= utils.AimdWindow:
+                self._adjust()
+            self._cond.notify_all()
+
+    def _adjust(self):
+        if self._latencies:
+            self.p50 = percentile(self._latencies, 0.5)
+            self.p95 = percentile(self._latencies, 0.95)
+            if self.best_p50 is None or self.p50 < self.best_p50:
+                self.best_p50 = self.p50
+
+        if self._throttled:
+            self.limit = max(self.minimum, self.limit * utils.AimdBackoff)
+            self.decision = f"x{utils.AimdBackoff} ({self._throttled} throttled)"
+        elif (self.p95 is not None and self._latencies and
+                self.p95 > self.best_p50 * utils.AimdLatencyTolerance):
+            self.limit = max(self.minimum, self.limit * 0.9)
+            self.decision = f"x0.9 (p95 {self.p95 * 1000:.0f}ms)"
+        elif self._saturated and self.limit < self.maximum:
+            self.limit = min(self.maximum, self.limit + 1)
+            self.decision = "+1"
+        else:
+            self.decision = "hold"
+
+        self._latencies = list()
+        self._throttled = 0
+        self._saturated = self.inflight >= int(self.limit)
+        self._window_start = time.monotonic()
+
+    def status(self):
+        with self._cond:
+            p95 = f"{self.p95 * 1000:.0f}ms" if self.p95 is not None else "-"
+            return (f"Concurrency {self.inflight}/{int(self.limit)}, "
+                    f"p95 {p95}, last: {self.decision}")
+
+
+class SendEngine:
+    """
+    Send one message to many numbers with a bounded worker pool. The
+    number of API requests in flight starts at `concurrency` and is then
+    tuned by an `AIMDController` from the API latency and 429/503s.
+
+    With a `senders` pool every recipient is sent from the number the
+    pool picks, otherwise from the user's `phone_num`. Recipients found
+    in `suppressed` (the user's opt-out list) are skipped.
+
+    Retryable errors (429, 5xx, network) go to a `RetryScheduler` and are
+    sent again after an exponential backoff, up to `RetryMaxAttempts`;
+    meanwhile the workers keep sending new recipients.
+
+    Callbacks run on worker threads:
+        * `on_sent(number, sid, sender)` after Twilio accepted the message.
+        * `on_failed(number, error, attempts)` when a send failed for good.
+        * `on_progress(done, total)` after every finished request.
+
+    `checkpoint(pending, summary)` is called every `CheckpointInterval`
+    seconds from the dispatching thread. While it runs no
+    recipient is read and no send finishes, so `pending` (numbers read
+    but not finished yet, including waiting retries) matches the reader
+    state and the `on_sent` / `on_failed` records written so far.
+    """
+
+    def __init__(self, user, message, recipients, total=0,
+                 concurrency=None, senders=None, on_sent=None, on_failed=None,
+                 on_progress=None, should_stop=None, checkpoint=None, suppressed=None):
+        self.user = user
+        self.suppressed = suppressed
+        self.senders = senders
+        self.message = message
+        self.recipients = recipients
+        self.total = total
+        self.controller = AIMDController(concurrency)
+        self.on_sent = on_sent
+        self.on_failed = on_failed
+        self.on_progress = on_progress
+        self.should_stop = should_stop
+        self.checkpoint = checkpoint
+        self.pending = set()
+        self.summary = CampaignSummary()
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        # sends submitted and not finished for good (includes retries)
+        self._outstanding = 0
+        self._idle = threading.Condition(self._lock)
+        self._pool = None
+        self.retries = None
+
+    def stop(self):
+        self._stopped.set()
+
+    def stopped(self):
+        if self.should_stop is not None and self.should_stop():
+            self._stopped.set()
+        return self._stopped.is_set()
+
+    def run(self):
+        """Send to every recipient and return the `CampaignSummary`."""
+        self.summary.started = last_checkpoint = time.monotonic()
+        self.retries = retry.RetryScheduler(self._submit)
+        try:
+            with ThreadPoolExecutor(max_workers=self.controller.maximum,
+                                    thread_name_prefix="send") as self._pool:
+                for number in self.recipients:
+                    if self.suppressed is not None and number in self.suppressed:
+                        self.summary.suppressed += 1
+                        continue
+                    with self._lock:
+                        self.pending.add(number)
+                    if self.stopped():
+                        # already read, stays pending for a resumed run
+                        break
+                    with self._lock:
+                        self._outstanding += 1
+                    self._submit(number, 0)
+
+                    if (self.checkpoint is not None and
+                            time.monotonic() - last_checkpoint >= utils.CheckpointInterval):
+                        self.save_checkpoint()
+                        last_checkpoint = time.monotonic()
+
+                # wait for the in-flight sends and the scheduled retries
+                with self._idle:
+                    while self._outstanding:
+                        if self.stopped():
+                            # waiting retries stay pending for a resumed run
+                            self._outstanding -= len(self.retries.clear())
+                        if self.checkpoint is not None and (
+                                time.monotonic() - last_checkpoint >= utils.CheckpointInterval):
+                            self.checkpoint(set(self.pending), self.summary)
+                            last_checkpoint = time.monotonic()
+                        self._idle.wait(0.25)
+        finally:
+            # a failing checkpoint must not leave the retry thread behind
+            self.retries.close()
+        self.summary.finished = time.monotonic()
+        return self.summary
+
+    def save_checkpoint(self):
+        with self._lock:
+            self.checkpoint(set(self.pending), self.summary)
+
+    def _submit(self, number, attempt):
+        self.controller.acquire()
+        self._pool.submit(self._send, number, attempt)
+
+    def _finish(self):
+        self._outstanding -= 1
+        if not self._outstanding:
+            self._idle.notify_all()
+
+    def _callback(self, callback, *args):
+        # a failing callback (closed log, full disk ...) must not keep the
+        # send from being finished, run() would wait for it forever
+        if callback is None:
+            return
+        try:
+            callback(*args)
+        except Exception:
+            log.exception("%s callback failed", getattr(callback, "__name__", "send"))
+
+    def _send(self, number, attempt=0):
+        sender = self.user["phone_num"]
+        if self.senders is not None:
+            sender = self.senders.acquire(number)
+        latency, throttled, begun = None, False, False
+        try:
+            rate_limit.Limiter.acquire(self.user["account_sid"], sender)
+            self.controller.begin()
+            begun = True
+            started = time.monotonic()
+            try:
+                sid = twilio_api.create_message(self.user, self.message, number, sender)
+            finally:
+                latency = time.monotonic() - started
+        except Exception as error:
+            throttled = retry.is_throttled(error)
+            with self._lock:
+                if not retry.is_retryable(error) or attempt + 1 >= utils.RetryMaxAttempts:
+                    self.summary.failed += 1
+                    self._callback(self.on_failed, number, error, attempt + 1)
+                    self.pending.discard(number)
+                    self._finish()
+                elif self._stopped.is_set():
+                    # stays pending for a resumed run
+                    self._finish()
+                else:
+                    self.summary.retried += 1
+                    self.retries.schedule(number, attempt + 1, retry.backoff(attempt + 1))
+        else:
+            with self._lock:
+                self.summary.sent += 1
+                self._callback(self.on_sent, number, sid, sender)
+                self.pending.discard(number)
+                self._finish()
+        finally:
+            if self.senders is not None:
+                self.senders.release(sender)
+            self.controller.release(latency, throttled, begun)
+            self._callback(self.on_progress, self.summary.sent + self.summary.failed +
+                           self.summary.suppressed, self.total)
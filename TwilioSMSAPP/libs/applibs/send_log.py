@@ -0,0 +1,116 @@
+import json
+import os
+import threading
+import time
+
+from libs.applibs import utils
+
+
+class SendLog:
+    """
+    Append-only JSON Lines log of sent messages. Every record is handed
+    to the OS as it happens (line buffered, so it survives the app dying)
+    and fsynced to disk in batches: after `flush_every` records or
+    `flush_interval` seconds, whichever comes first.
+    """
+
+    def __init__(self, path, flush_every=None, flush_interval=None):
+        self.path = path
+        self.flush_every = flush_every or utils.SendLogFlushEvery
+        self.flush_interval = flush_interval or utils.SendLogFlushInterval
+        self._file = open(path, "a", encoding="utf-8", buffering=1)
+        self._pending = 0
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flusher.start()
+
+    def append(self, record):
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._pending += 1
+            if (self._pending >= self.flush_every or
+                    time.monotonic() - self._last_flush >= self.flush_interval):
+                self._flush()
+
+    def _flush(self):
+        if self._pending:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._pending = 0
+        self._last_flush = time.monotonic()
+
+    def flush(self):
+        with self._lock:
+            if not self._file.closed:
+                self._flush()
+
+    def _flush_loop(self):
+        # pick up the tail of a batch when sending pauses
+        while not self._closed.wait(self.flush_interval):
+            self.flush()
+
+    def tell(self):
+        """Flush and return the log size, an offset for `SendLogReader`."""
+        with self._lock:
+            self._flush()
+            return self._file.tell()
+
+    def close(self):
+        self._closed.set()
+        with self._lock:
+            if not self._file.closed:
+                self._flush()
+                self._file.close()
+
+
+class SendLogReader:
+    """
+    Tail a `SendLog` file: every `read_new()` returns only the records
+    appended since the last call. A half written last line is left for
+    the next call.
+    """
+
+    def __init__(self, path, offset=0):
+        self.path = path
+        self.offset = offset
+
+    def read_new(self):
+        records = list()
+        try:
+            with open(self.path, "rb") as logfile:
+                logfile.seek(self.offset)
+                for line in logfile:
+                    if not line.endswith(b"\n"):
+                        break
+                    self.offset += len(line)
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        continue
+        except FileNotFoundError:
+            pass
+        return records
+
+
+_logs = dict()
+_logs_lock = threading.Lock()
+
+
+def get_log(path):
+    """Shared `SendLog` for `path`, so every screen appends to one file."""
+    with _logs_lock:
+        log = _logs.get(path)
+        if log is None:
+            log = _logs[path] = SendLog(path)
+        return log
+
+
+def close_log(path):
+    with _logs_lock:
+        log = _logs.pop(path, None)
+    if log is not None:
+        log.close()
+
@@ -0,0 +1,65 @@
+import threading
+import zlib
+
+from libs.applibs import utils
+
+
+def split_numbers(text):
+    """'+111, +222' -> ['+111', '+222'] (order kept, duplicates removed)"""
+    numbers = list()
+    for number in str(text).replace(";", ",").split(","):
+        number = number.strip()
+        if number and number not in numbers:
+            numbers.append(number)
+    return numbers
+
+
+class SenderPool:
+    """
+    Spread recipients across the user's sending numbers.
+
+    A recipient that already heard from one of our numbers is sticky: it
+    gets the sender `history(recipient)` returns again, as long as that
+    number is still in the pool. Other recipients are spread by
+    `strategy`: "hash" (a stable hash of the number, so retries and later
+    campaigns pick the same sender without remembering it) or
+    "least_loaded" (fewest sends in flight).
+    """
+
+    def __init__(self, numbers, strategy=None, history=None):
+        if not numbers:
+            raise ValueError("Sender pool needs at least one number.")
+        self.numbers = list(numbers)
+        self.strategy = strategy or utils.SenderStrategy
+        self.history = history
+        self.load = dict.fromkeys(self.numbers, 0)
+        self.used = dict.fromkeys(self.numbers, 0)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_user(cls, user, history=None, strategy=None):
+        """
+        Pool of `user["phone_pool"]` (or the single `phone_num`), sticky
+        on `history` (recipient -> sender it last heard from, or None).
+        """
+        numbers = user.get("phone_pool") or [user["phone_num"]]
+        return cls(numbers, strategy=strategy, history=history)
+
+    def _choose(self, recipient):
+        if self.strategy == "least_loaded":
+            return min(self.numbers, key=lambda number: (self.load[number], self.used[number]))
+        return self.numbers[zlib.crc32(recipient.encode()) % len(self.numbers)]
+
+    def acquire(self, recipient):
+        """Sender number for `recipient`, counted as in flight until `release`."""
+        sender = self.history(recipient) if self.history is not None else None
+        with self._lock:
+            if sender not in self.load:
+                sender = self._choose(recipient)
+            self.load[sender] += 1
+            self.used[sender] += 1
+            return sender
+
+    def release(self, sender):
+        with self._lock:
+            self.load[sender] -= 1
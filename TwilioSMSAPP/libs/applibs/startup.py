@@ -0,0 +1,103 @@
+import builtins
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# TWILIO_PROFILE_STARTUP=1 turns on the per-module import timing and the
+# report file; the phase timings are always kept (they cost nothing)
+ENABLED = os.environ.get("TWILIO_PROFILE_STARTUP", "") not in ("", "0")
+
+
+class StartupProfile:
+    """
+    Wall time of the startup phases (imports, server start, kv parse,
+    screen build, first frame), of every kv file and screen, and with
+    `install_import_hook` of every module imported on the main thread:
+    cumulative time (with what it imports) and self time.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = dict()
+        self.items = dict() # kind -> {name: seconds}
+        self.imports = dict() # module -> [cumulative, self]
+        self._stack = list()
+        self._original_import = None
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def add_phase(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.perf_counter() - started)
+
+    def record(self, kind, name, seconds):
+        """Time of one kv file, screen ... `kind` also counts as a phase."""
+        self.items.setdefault(kind, dict())[name] = seconds
+        self.add_phase(kind, seconds)
+
+    # -- per module import cost
+
+    def install_import_hook(self):
+        if self._original_import is not None:
+            return
+        self._original_import = original = builtins.__import__
+        main = threading.main_thread()
+
+        def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+            if (level or name in sys.modules or
+                    threading.current_thread() is not main):
+                return original(name, globals, locals, fromlist, level)
+            self._stack.append(0.0)
+            started = time.perf_counter()
+            try:
+                return original(name, globals, locals, fromlist, level)
+            finally:
+                elapsed = time.perf_counter() - started
+                children = self._stack.pop()
+                if self._stack:
+                    self._stack[-1] += elapsed
+                cumulative, own = self.imports.get(name, (0.0, 0.0))
+                self.imports[name] = (cumulative + elapsed, own + elapsed - children)
+
+        builtins.__import__ = timed_import
+
+    def remove_import_hook(self):
+        if self._original_import is not None:
+            builtins.__import__ = self._original_import
+            self._original_import = None
+
+    # -- report
+
+    def as_dict(self, top=40):
+        imports = sorted(self.imports.items(), key=lambda item: item[1][0], reverse=True)
+        return {
+            "total_ms": round(self.elapsed() * 1000, 1),
+            "phases_ms": {name: round(seconds * 1000, 1)
+                          for name, seconds in self.phases.items()},
+            **{f"{kind}_ms": {name: round(seconds * 1000, 1)
+                              for name, seconds in items.items()}
+               for kind, items in self.items.items()},
+            "imports_ms": [{"module": name,
+                            "cumulative": round(cumulative * 1000, 1),
+                            "self": round(own * 1000, 1)}
+                           for name, (cumulative, own) in imports[:top]],
+        }
+
+    def write_report(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as report:
+            json.dump(self.as_dict(), report, indent=4)
+
+
+Profile = StartupProfile()
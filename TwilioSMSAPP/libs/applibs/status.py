@@ -0,0 +1,43 @@
+"""
+Message status as a monotonic lattice.
+
+Twilio posts status callbacks independently, so they may arrive out of
+order or more than once. A message only ever moves up:
+
+    accepted/scheduled -> queued -> sending -> sent -> delivered/undelivered/failed -> read
+
+and a callback with a lower or equal rank than the current status is kept
+in the event history but does not change the status.
+"""
+
+RANK = {
+    "accepted": 0,
+    "scheduled": 0,
+    "queued": 1,
+    "sending": 2,
+    "sent": 3,
+    "receiving": 3,
+    "received": 4,
+    "delivered": 4,
+    "undelivered": 4,
+    "failed": 4,
+    "canceled": 4,
+    "partially_delivered": 4,
+    "read": 5,
+}
+
+TERMINAL = {"received", "delivered", "undelivered", "failed", "canceled", "read"}
+
+
+def rank(status):
+    """Rank of `status`, -1 for an unknown (or missing) one."""
+    return RANK.get(status, -1)
+
+
+def advances(current, new):
+    """True when a message at `current` should move to `new`."""
+    return rank(new) > rank(current)
+
+
+def is_terminal(status):
+    return status in TERMINAL
@@ -0,0 +1,568 @@
+import json
+import os
+import sqlite3
+import threading
+
+from libs.applibs import utils, status
+from libs.applibs.recipients import normalize_number
+from libs.applibs.send_log import SendLogReader
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    sid TEXT PRIMARY KEY,
+    username TEXT,
+    direction TEXT NOT NULL DEFAULT 'outbound',
+    number TEXT,
+    from_number TEXT,
+    account_sid TEXT,
+    message TEXT,
+    campaign TEXT,
+    datetime TEXT,
+    timestamp REAL,
+    status TEXT,
+    status_datetime TEXT,
+    status_timestamp REAL,
+    seq INTEGER,
+    number_key TEXT,
+    status_rank INTEGER,
+    latency REAL
+);
+CREATE INDEX IF NOT EXISTS messages_number ON messages (username, number, timestamp);
+CREATE INDEX IF NOT EXISTS messages_seq ON messages (seq);
+CREATE INDEX IF NOT EXISTS messages_timestamp ON messages (timestamp);
+CREATE INDEX IF NOT EXISTS messages_status_timestamp ON messages (status_timestamp);
+
+CREATE TABLE IF NOT EXISTS status_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    message_sid TEXT NOT NULL,
+    status TEXT,
+    datetime TEXT,
+    timestamp REAL,
+    payload TEXT
+);
+CREATE INDEX IF NOT EXISTS status_events_sid ON status_events (message_sid, timestamp);
+CREATE INDEX IF NOT EXISTS status_events_timestamp ON status_events (timestamp);
+
+-- one row per conversation, kept up to date by every message write, so
+-- the Inbox lists conversations by latest activity without scanning messages
+CREATE TABLE IF NOT EXISTS threads (
+    username TEXT NOT NULL,
+    number_key TEXT NOT NULL,
+    number TEXT,
+    last_timestamp REAL,
+    last_message TEXT,
+    last_direction TEXT,
+    inbound INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (username, number_key)
+);
+CREATE INDEX IF NOT EXISTS threads_activity ON threads (username, last_timestamp, number_key);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# conversation index: normalized number -> messages by time. Created after
+# `migrate` so databases from before `number_key` get the column first.
+INDEXES = """
+CREATE INDEX IF NOT EXISTS messages_thread ON messages (username, number_key, timestamp, sid);
+CREATE UNIQUE INDEX IF NOT EXISTS status_events_unique ON status_events (message_sid, status);
+CREATE INDEX IF NOT EXISTS messages_report ON messages (status_timestamp, sid);
+CREATE INDEX IF NOT EXISTS messages_report_status ON messages (status, status_timestamp, sid);
+CREATE INDEX IF NOT EXISTS messages_report_number ON messages (number_key, status_timestamp, sid);
+-- delivery latency summary of /metrics: counts, averages and percentiles
+-- walk this instead of scanning and sorting every message
+CREATE INDEX IF NOT EXISTS messages_latency ON messages (latency) WHERE latency IS NOT NULL;
+"""
+
+UPSERT_MESSAGE = """
+INSERT INTO messages (sid, username, direction, number, number_key, from_number,
+                      account_sid, message, campaign, datetime, timestamp, seq)
+VALUES (:SID, :Username, :Direction, :Number, :NumberKey, :From,
+        :AccountSid, :Message, :Campaign, :DateTime, :TimeStamp,
+        (SELECT COALESCE(MAX(seq), 0) + 1 FROM messages))
+ON CONFLICT (sid) DO UPDATE SET
+    seq = excluded.seq,
+    username = excluded.username, direction = excluded.direction,
+    number = excluded.number, number_key = excluded.number_key,
+    from_number = COALESCE(excluded.from_number, from_number),
+    account_sid = COALESCE(excluded.account_sid, account_sid),
+    message = excluded.message, campaign = excluded.campaign,
+    datetime = excluded.datetime, timestamp = excluded.timestamp,
+    latency = CASE WHEN status = 'delivered'
+                   THEN status_timestamp - excluded.timestamp ELSE latency END
+"""
+
+UPSERT_THREAD = """
+INSERT INTO threads (username, number_key, number, last_timestamp, last_message,
+                     last_direction, inbound)
+VALUES (:Username, :NumberKey, :Number, :TimeStamp, :Message, :Direction,
+        :Direction = 'inbound')
+ON CONFLICT (username, number_key) DO UPDATE SET
+    number = CASE WHEN excluded.last_timestamp >= COALESCE(last_timestamp, 0)
+                  THEN excluded.number ELSE number END,
+    last_message = CASE WHEN excluded.last_timestamp >= COALESCE(last_timestamp, 0)
+                        THEN excluded.last_message ELSE last_message END,
+    last_direction = CASE WHEN excluded.last_timestamp >= COALESCE(last_timestamp, 0)
+                          THEN excluded.last_direction ELSE last_direction END,
+    last_timestamp = MAX(COALESCE(last_timestamp, 0), COALESCE(excluded.last_timestamp, 0)),
+    inbound = MAX(inbound, excluded.inbound)
+"""
+
+# the other columns come from the row with MAX(timestamp)
+BACKFILL_THREADS = """
+INSERT OR IGNORE INTO threads (username, number_key, number, last_timestamp, last_message,
+                               last_direction)
+SELECT username, number_key, number, MAX(timestamp), message, direction
+FROM messages WHERE username IS NOT NULL AND number_key IS NOT NULL
+GROUP BY username, number_key;
+UPDATE threads SET inbound = 1 WHERE EXISTS (
+    SELECT 1 FROM messages WHERE messages.username = threads.username
+    AND messages.number_key = threads.number_key AND direction = 'inbound');
+"""
+
+# a status callback may come before the send is stored, so it creates the
+# row and the send fills in the rest later (and gives it its seq). The
+# status only moves up the `status.RANK` lattice, whatever the arrival order.
+UPSERT_STATUS = """
+INSERT INTO messages (sid, number, number_key, from_number, account_sid,
+                      status, status_datetime, status_timestamp, status_rank)
+VALUES (:MessageSid, :To, :NumberKey, :From, :AccountSid, :SmsStatus, :DateTime, :TimeStamp,
+        :StatusRank)
+ON CONFLICT (sid) DO UPDATE SET
+    status = CASE WHEN excluded.status_rank > COALESCE(status_rank, -1)
+                  THEN excluded.status ELSE status END,
+    status_datetime = CASE WHEN excluded.status_rank > COALESCE(status_rank, -1)
+                           THEN excluded.status_datetime ELSE status_datetime END,
+    status_timestamp = CASE WHEN excluded.status_rank > COALESCE(status_rank, -1)
+                            THEN excluded.status_timestamp ELSE status_timestamp END,
+    latency = CASE WHEN excluded.status_rank > COALESCE(status_rank, -1)
+                        AND excluded.status = 'delivered'
+                   THEN excluded.status_timestamp - timestamp ELSE latency END,
+    status_rank = MAX(COALESCE(status_rank, -1), excluded.status_rank),
+    account_sid = COALESCE(account_sid, excluded.account_sid),
+    from_number = COALESCE(from_number, excluded.from_number),
+    number = COALESCE(number, excluded.number),
+    number_key = COALESCE(number_key, excluded.number_key)
+"""
+
+# one event per (message, status): repeated callbacks are ignored
+INSERT_EVENT = """
+INSERT OR IGNORE INTO status_events (message_sid, status, datetime, timestamp, payload)
+VALUES (:MessageSid, :SmsStatus, :DateTime, :TimeStamp, :Payload)
+"""
+
+MESSAGE_COLUMNS = ("SID", "Username", "Direction", "Number", "From",
+                   "AccountSid", "Message", "Campaign", "DateTime", "TimeStamp")
+
+
+def number_key(number):
+    """Key of a conversation: the normalized number (or the raw text)."""
+    if number is None:
+        return None
+    return normalize_number(number) or str(number).strip()
+
+
+def message_params(report, username=None):
+    """
+    Send report dict (as written by the screens), or an inbound message
+    with "Direction": "inbound" -> UPSERT_MESSAGE params
+    """
+    params = dict.fromkeys(MESSAGE_COLUMNS)
+    params["Username"] = username
+    params["Direction"] = "outbound"
+    params.update({k: v for k, v in report.items() if k in params})
+    params["NumberKey"] = number_key(params["Number"])
+    return params
+
+
+STATUS_KEYS = ("MessageSid", "SmsStatus", "To", "From", "AccountSid",
+               "DateTime", "TimeStamp")
+
+
+def status_report(report):
+    """Status callback form -> the dict `Store.reports()` returns"""
+    result = {key: report.get(key) for key in STATUS_KEYS}
+    result["SmsStatus"] = report.get("SmsStatus") or report.get("MessageStatus")
+    return result
+
+
+def status_params(report):
+    """Twilio status callback form (+ DateTime/TimeStamp) -> params"""
+    params = {k: report.get(k) for k in
+              ("MessageSid", "To", "From", "AccountSid", "DateTime", "TimeStamp")}
+    params["SmsStatus"] = report.get("SmsStatus") or report.get("MessageStatus")
+    params["StatusRank"] = status.rank(params["SmsStatus"])
+    params["NumberKey"] = number_key(params["To"])
+    params["Payload"] = json.dumps(report)
+    return params
+
+
+class Store:
+    """
+    Messages and status callbacks in one SQLite database (WAL mode), used
+    by the screens and `server.py` instead of the JSON report files.
+    Every thread gets its own connection.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        with self.connection() as con:
+            con.executescript(SCHEMA)
+            self.migrate(con)
+            con.executescript(INDEXES)
+
+    def migrate(self, con):
+        """Bring a database made by an older version up to the schema."""
+        columns = [row[1] for row in con.execute("PRAGMA table_info(messages)")]
+        if "number_key" not in columns:
+            con.execute("ALTER TABLE messages ADD COLUMN number_key TEXT")
+            rows = con.execute("SELECT sid, number FROM messages").fetchall()
+            con.executemany("UPDATE messages SET number_key = ? WHERE sid = ?",
+                            [(number_key(number), sid) for sid, number in rows])
+        if "status_rank" not in columns:
+            con.execute("ALTER TABLE messages ADD COLUMN status_rank INTEGER")
+            con.execute("ALTER TABLE messages ADD COLUMN latency REAL")
+            rows = con.execute("SELECT sid, status FROM messages WHERE status IS NOT NULL").fetchall()
+            con.executemany("UPDATE messages SET status_rank = ? WHERE sid = ?",
+                            [(status.rank(value), sid) for sid, value in rows])
+            # keep the first event of every (message, status) for the unique index
+            con.execute("DELETE FROM status_events WHERE id NOT IN "
+                        "(SELECT MIN(id) FROM status_events GROUP BY message_sid, status)")
+        if self.get_meta("threads") is None:
+            con.executescript(BACKFILL_THREADS)
+            con.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('threads', '1')")
+
+    def connection(self):
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = sqlite3.connect(self.path, timeout=30)
+            con.row_factory = sqlite3.Row
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            self._local.con = con
+        return con
+
+    def close(self):
+        con = getattr(self._local, "con", None)
+        if con is not None:
+            con.close()
+            self._local.con = None
+
+    # -- writes
+
+    def write_batch(self, messages=(), statuses=()):
+        """
+        Commit `messages` ([(report, username)]) and status `statuses`
+        in one transaction. Returns the seqs the messages got, as the
+        range (after, upto], or None without messages.
+        """
+        message_rows = [message_params(report, username) for report, username in messages]
+        status_rows = [status_params(report) for report in statuses]
+        seqs = None
+        with self._write_lock, self.connection() as con:
+            if message_rows:
+                con.executemany(UPSERT_MESSAGE, message_rows)
+                con.executemany(UPSERT_THREAD, [row for row in message_rows
+                                                if row["Username"] and row["NumberKey"]])
+                # every row took the next seq inside this transaction
+                upto = con.execute("SELECT MAX(seq) FROM messages").fetchone()[0]
+                seqs = (upto - len(message_rows), upto)
+            if status_rows:
+                con.executemany(UPSERT_STATUS, status_rows)
+                con.executemany(INSERT_EVENT, status_rows)
+        return seqs
+
+    def add_messages(self, reports, username=None):
+        self.write_batch(messages=[(report, username) for report in reports])
+
+    def add_message(self, report, username=None):
+        self.add_messages([report], username)
+
+    def add_statuses(self, reports):
+        self.write_batch(statuses=reports)
+
+    def add_status(self, report):
+        self.add_statuses([report])
+
+    def clear(self, username):
+        """Delete the user's messages and every status report."""
+        with self._write_lock, self.connection() as con:
+            con.execute("DELETE FROM messages WHERE username = ? OR username IS NULL",
+                        (username,))
+            con.execute("DELETE FROM threads WHERE username = ?", (username,))
+            con.execute("DELETE FROM status_events")
+
+    # -- reads
+
+    def _report(self, row):
+        return {
+            "SID": row["sid"],
+            "Direction": row["direction"],
+            "Number": row["number"],
+            "From": row["from_number"],
+            "Message": row["message"],
+            "Campaign": row["campaign"],
+            "DateTime": row["datetime"],
+            "TimeStamp": row["timestamp"],
+            "Status": row["status"],
+        }
+
+    def messages_after(self, username, seq=0, skip=()):
+        """
+        (last seq, messages of `username` stored after `seq`), leaving out
+        the seq ranges (after, upto] in `skip`
+        """
+        where = "seq > ? AND username = ?"
+        params = [seq, username]
+        for after, upto in skip:
+            where += " AND NOT (seq > ? AND seq <= ?)"
+            params += [after, upto]
+        rows = self.connection().execute(
+            f"SELECT * FROM messages WHERE {where} ORDER BY seq", params).fetchall()
+        if rows:
+            seq = rows[-1]["seq"]
+        return seq, [self._report(row) for row in rows]
+
+    def messages_for_number(self, username, number, limit=-1, before=None):
+        """
+        Conversation with `number`, oldest first, read through the
+        `messages_thread` index. With `limit` only the newest `limit`
+        messages older than the `before` cursor are returned.
+
+        Returns (messages, cursor for the next older page or None).
+        """
+        where = "username = ? AND number_key = ?"
+        params = [username, number_key(number)]
+        if before is not None:
+            where += " AND (timestamp < ? OR (timestamp = ? AND sid < ?))"
+            params += [before[0], before[0], before[1]]
+        rows = self.connection().execute(
+            f"SELECT * FROM messages WHERE {where} "
+            "ORDER BY timestamp DESC, sid DESC LIMIT ?", params + [limit]).fetchall()
+        cursor = None
+        if limit >= 0 and len(rows) == limit:
+            cursor = (rows[-1]["timestamp"], rows[-1]["sid"])
+        return [self._report(row) for row in reversed(rows)], cursor
+
+    def threads(self, username, limit=-1, before=None, inbound=False):
+        """
+        Conversations of `username` by latest activity, newest first, read
+        through the `threads_activity` index. With `inbound` only those
+        where the contact wrote to us. `before` is the cursor returned
+        for the previous page.
+
+        Returns ([{"Number", "Message", "Direction", "TimeStamp"}], cursor or None).
+        """
+        where = "username = ?"
+        params = [username]
+        if inbound:
+            where += " AND inbound"
+        if before is not None:
+            where += " AND (last_timestamp < ? OR (last_timestamp = ? AND number_key < ?))"
+            params += [before[0], before[0], before[1]]
+        rows = self.connection().execute(
+            f"SELECT * FROM threads WHERE {where} "
+            "ORDER BY last_timestamp DESC, number_key DESC LIMIT ?", params + [limit]).fetchall()
+        cursor = None
+        if limit >= 0 and len(rows) == limit:
+            cursor = (rows[-1]["last_timestamp"], rows[-1]["number_key"])
+        return [{
+            "Number": row["number"],
+            "Message": row["last_message"],
+            "Direction": row["last_direction"],
+            "TimeStamp": row["last_timestamp"],
+        } for row in rows], cursor
+
+    def last_sender(self, username, number):
+        """Our number `number` last heard from (None if never), by the thread index"""
+        row = self.connection().execute(
+            "SELECT from_number FROM messages WHERE username = ? AND number_key = ? "
+            "AND from_number IS NOT NULL ORDER BY timestamp DESC LIMIT 1",
+            (username, number_key(number))).fetchone()
+        return row[0] if row else None
+
+    def _status_report(self, row):
+        return {
+            "MessageSid": row["sid"],
+            "SmsStatus": row["status"],
+            "To": row["number"],
+            "From": row["from_number"],
+            "AccountSid": row["account_sid"],
+            "DateTime": row["status_datetime"],
+            "TimeStamp": row["status_timestamp"],
+        }
+
+    def reports(self, limit=-1, offset=0):
+        """Latest status of every message, newest first, in callback form."""
+        rows = self.connection().execute(
+            "SELECT * FROM messages WHERE status IS NOT NULL "
+            "ORDER BY status_timestamp DESC LIMIT ? OFFSET ?",
+            (limit, offset)).fetchall()
+        return [self._status_report(row) for row in rows]
+
+    def report_page(self, username=None, limit=-1, after=None, newest_first=True,
+                    status=None, number=None, since=None, until=None):
+        """
+        One page of the Report: latest status of the messages of
+        `username` (and of callbacks not matched to a send yet), in
+        callback form. Filters on `status`, `number` and the status time
+        (`since` <= TimeStamp < `until`) are done by the query on the
+        `messages_report*` indexes. `after` is the cursor returned for
+        the previous page.
+
+        Returns (reports, cursor for the next page or None).
+        """
+        where = "status IS NOT NULL"
+        params = []
+        if username is not None:
+            # not indexable on purpose: the page walks the status_timestamp index
+            where += " AND COALESCE(username, ?) = ?"
+            params += [username, username]
+        if status:
+            where += " AND status = ?"
+            params.append(status)
+        if number:
+            where += " AND number_key = ?"
+            params.append(number_key(number))
+        if since is not None:
+            where += " AND status_timestamp >= ?"
+            params.append(since)
+        if until is not None:
+            where += " AND status_timestamp < ?"
+            params.append(until)
+        order, beyond = ("DESC", "<") if newest_first else ("ASC", ">")
+        if after is not None:
+            where += (f" AND (status_timestamp {beyond} ? OR "
+                      f"(status_timestamp = ? AND sid {beyond} ?))")
+            params += [after[0], after[0], after[1]]
+        rows = self.connection().execute(
+            f"SELECT * FROM messages WHERE {where} "
+            f"ORDER BY status_timestamp {order}, sid {order} LIMIT ?",
+            params + [limit]).fetchall()
+        cursor = None
+        if limit >= 0 and len(rows) == limit:
+            cursor = (rows[-1]["status_timestamp"], rows[-1]["sid"])
+        return [self._status_report(row) for row in rows], cursor
+
+    def status_events_after(self, event_id=0):
+        """(last event id, status callbacks stored after `event_id`)"""
+        rows = self.connection().execute(
+            "SELECT id, payload FROM status_events WHERE id > ? ORDER BY id",
+            (event_id,)).fetchall()
+        if rows:
+            event_id = rows[-1][0]
+        return event_id, [status_report(json.loads(row[1])) for row in rows]
+
+    def last_event_id(self):
+        return self.connection().execute(
+            "SELECT COALESCE(MAX(id), 0) FROM status_events").fetchone()[0]
+
+    def last_seq(self):
+        return self.connection().execute(
+            "SELECT COALESCE(MAX(seq), 0) FROM messages").fetchone()[0]
+
+    def status_events(self, message_sid):
+        """Every distinct status callback of a message, in arrival order."""
+        rows = self.connection().execute(
+            "SELECT payload FROM status_events WHERE message_sid = ? "
+            "ORDER BY timestamp", (message_sid,)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def delivery_latency(self, username=None):
+        """Send -> delivered seconds over the delivered messages."""
+        where = "latency IS NOT NULL"
+        params = []
+        if username is not None:
+            where += " AND username = ?"
+            params.append(username)
+        con = self.connection()
+        count, avg, high = con.execute(
+            f"SELECT COUNT(*), AVG(latency), MAX(latency) FROM messages WHERE {where}",
+            params).fetchone()
+
+        def percentile(p):
+            if not count:
+                return 0
+            return con.execute(
+                f"SELECT latency FROM messages WHERE {where} ORDER BY latency "
+                "LIMIT 1 OFFSET ?", params + [min(count - 1, int(count * p))]).fetchone()[0]
+
+        return {
+            "delivered": count,
+            "avg": round(avg or 0, 3),
+            "p50": round(percentile(0.5), 3),
+            "p95": round(percentile(0.95), 3),
+            "max": round(high or 0, 3),
+        }
+
+    # -- importers
+
+    def get_meta(self, key, default=None):
+        row = self.connection().execute(
+            "SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        with self._write_lock, self.connection() as con:
+            con.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                        (key, str(value)))
+
+    def import_json(self, path, username=None):
+        """
+        One-shot import of an old `{SID: report}` file: a user's
+        `*_report.json` (with `username`) or the status `report.json`.
+        The file is renamed to `*.imported` afterwards.
+        """
+        data = utils.read_json_file(path)
+        if data == 0:
+            return 0
+        if username is None:
+            self.add_statuses(data.values())
+        else:
+            self.add_messages(data.values(), username)
+        os.replace(path, path + ".imported")
+        return len(data)
+
+    def import_send_log(self, path, username):
+        """
+        One-shot import of a send log written before the store existed;
+        every send is stored as it happens since, so a log is only read
+        the first time (recorded in `meta`).
+        """
+        key = "sendlog:" + path
+        if self.get_meta(key) is not None:
+            return 0
+        records = SendLogReader(path).read_new()
+        if records:
+            self.add_messages(records, username)
+        self.set_meta(key, "imported")
+        return len(records)
+
+    def import_legacy(self, username):
+        """Pull the old JSON files and the send log of `username` in, once."""
+        if utils.ReportDataFile and os.path.exists(utils.ReportDataFile):
+            self.import_json(utils.ReportDataFile)
+        if utils.UserDataFile and os.path.exists(utils.UserDataFile):
+            self.import_json(utils.UserDataFile, username)
+        if utils.UserLogFile:
+            if os.path.exists(utils.UserLogFile):
+                self.import_send_log(utils.UserLogFile, username)
+            elif self.get_meta("sendlog:" + utils.UserLogFile) is None:
+                # a log started from now on only holds sends stored already
+                self.set_meta("sendlog:" + utils.UserLogFile, "imported")
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = Store(utils.StoreFile)
+        return _store
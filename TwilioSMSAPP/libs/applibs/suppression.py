@@ -0,0 +1,259 @@
+import os
+import threading
+import time
+from array import array
+
+from libs.applibs import utils
+from libs.applibs.recipients import (PackedNumberSet, RecipientReader,
+                                     normalize_number, pack_number)
+
+# Twilio's standard opt-out / opt-in keywords (the whole message, any case)
+OPT_OUT = {"STOP", "STOPALL", "UNSUBSCRIBE", "CANCEL", "END", "QUIT", "OPTOUT", "REVOKE"}
+OPT_IN = {"START", "YES", "UNSTOP"}
+
+
+def keyword(body):
+    """"STOP", "START" or None for an inbound message body."""
+    text = str(body or "").strip().strip(".!").upper()
+    if text in OPT_OUT:
+        return "STOP"
+    if text in OPT_IN:
+        return "START"
+    return None
+
+
+class SuppressionList:
+    """
+    Numbers we must not text, of one user.
+
+    On disk: `<path>.bin`, a sorted array of packed numbers (8 bytes each),
+    plus `<path>.log`, a journal of STOP/START changes made since. Every
+    change goes through the journal and any process may append to it
+    (the callback server does for inbound keywords, see `apply_keyword`).
+    `compact` renames the journal to `<path>.log.old` before folding it
+    into the array, so lines appended meanwhile land in a fresh journal
+    instead of being truncated away.
+
+    In memory the numbers sit in a `PackedNumberSet`, so checking a
+    recipient is one hash probe whatever the size of the list. The
+    journal is looked at again every `SuppressionCheckInterval` seconds
+    during checks, which picks up opt-outs arriving mid campaign.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._next_check = 0
+        self.load()
+
+    @property
+    def array_path(self):
+        return self.path + ".bin"
+
+    @property
+    def journal_path(self):
+        return self.path + ".log"
+
+    @property
+    def rotated_path(self):
+        return self.journal_path + ".old"
+
+    def __len__(self):
+        return len(self._numbers)
+
+    def __contains__(self, number):
+        """`number` as normalized by the recipient reader."""
+        if time.monotonic() >= self._next_check:
+            self.refresh()
+        return pack_number(number) in self._numbers
+
+    # -- loading
+
+    def _stat(self, path):
+        try:
+            stat = os.stat(path)
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None, 0
+
+    def load(self):
+        with self._lock:
+            keys = array("Q")
+            if os.path.exists(self.array_path):
+                with open(self.array_path, "rb") as arrayfile:
+                    keys.frombytes(arrayfile.read())
+            self._array_stat = self._stat(self.array_path)
+            self._numbers = PackedNumberSet(len(keys) + 1024)
+            for key in keys:
+                self._numbers.add(key)
+            # left over by a compaction that didn't finish
+            self._read_journal(self.rotated_path, 0)
+            self._journal_offset = 0
+            self._read_journal()
+
+    def refresh(self):
+        """Pick up what other processes wrote since the last look."""
+        self._next_check = time.monotonic() + utils.SuppressionCheckInterval
+        journal_size = self._stat(self.journal_path)[1]
+        if (self._stat(self.array_path) != self._array_stat or
+                journal_size < self._journal_offset):
+            # compacted by someone else
+            self.load()
+        elif journal_size > self._journal_offset:
+            with self._lock:
+                self._read_journal()
+
+    def _read_journal(self, path=None, offset=None):
+        """Apply the journal lines after `offset`, return the offset after them."""
+        if path is None:
+            path, offset = self.journal_path, self._journal_offset
+        try:
+            journal = open(path, "rb")
+        except FileNotFoundError:
+            return offset
+        with journal:
+            journal.seek(offset)
+            for line in journal:
+                if not line.endswith(b"\n"):
+                    # still being written
+                    break
+                offset += len(line)
+                action, _, number = line.decode("utf-8", errors="replace").partition(" ")
+                number = normalize_number(number)
+                if number is None:
+                    continue
+                if action == "STOP":
+                    self._numbers.add(pack_number(number))
+                elif action == "START":
+                    self._numbers.discard(pack_number(number))
+        if path == self.journal_path:
+            self._journal_offset = offset
+        return offset
+
+    # -- changes
+
+    def _journal(self, action, number):
+        number = normalize_number(number)
+        if number is None:
+            return False
+        with self._lock:
+            self._read_journal()
+            self._append([f"{action} {number}\n"])
+            if action == "STOP":
+                return self._numbers.add(pack_number(number))
+            return self._numbers.discard(pack_number(number))
+
+    def _append(self, lines):
+        # with the journal read up to its end, skip our own lines; when
+        # another process appended meanwhile they are read (again) later
+        start, end = append_journal(self.journal_path, lines)
+        if start == self._journal_offset:
+            self._journal_offset = end
+
+    def add(self, number):
+        """Suppress `number`, return False when it already was."""
+        return self._journal("STOP", number)
+
+    def remove(self, number):
+        return self._journal("START", number)
+
+    def import_files(self, paths):
+        """Suppress every number in the files (one per line), return how many were new."""
+        added = list()
+        with self._lock:
+            self._read_journal()
+            for number in RecipientReader(paths):
+                if self._numbers.add(pack_number(number)):
+                    added.append(f"STOP {number}\n")
+            self._append(added)
+        self.compact()
+        return len(added)
+
+    def compact(self):
+        """
+        Fold the journal into the sorted array. Returns False when the
+        journal can't be rotated now (open in another process on
+        Windows); nothing is lost, it is folded in next time.
+        """
+        with self._lock:
+            if os.path.exists(self.rotated_path):
+                # an earlier compaction didn't finish: replay it and the
+                # journal after it, in order
+                self._read_journal(self.rotated_path, 0)
+                self._journal_offset = 0
+                os.remove(self.rotated_path)
+            self._read_journal()
+            try:
+                os.replace(self.journal_path, self.rotated_path)
+                rotated = True
+            except FileNotFoundError:
+                rotated = False
+            except PermissionError:
+                return False
+            # appended between the last read and the rename
+            offset = self._read_journal(self.rotated_path, self._journal_offset)
+
+            keys = array("Q", sorted(self._numbers))
+            tmp = self.array_path + ".tmp"
+            with open(tmp, "wb") as arrayfile:
+                keys.tofile(arrayfile)
+            os.replace(tmp, self.array_path)
+            self._array_stat = self._stat(self.array_path)
+
+            if rotated:
+                # a writer that opened the journal before the rename may
+                # just have appended to the rotated file: carry that over
+                with open(self.rotated_path, "rb") as journal:
+                    journal.seek(offset)
+                    append_journal(self.journal_path,
+                                   [line.decode("utf-8", errors="replace")
+                                    for line in journal if line.endswith(b"\n")])
+                os.remove(self.rotated_path)
+            self._journal_offset = 0
+            self._read_journal()
+            return True
+
+
+def append_journal(path, lines):
+    """
+    Append STOP/START `lines` to a journal, whole lines in one write.
+    Returns the journal offsets (before, after) of what was written.
+    """
+    with open(path, "ab") as journal:
+        start = journal.tell()
+        journal.write("".join(lines).encode())
+        return start, journal.tell()
+
+
+_lists = dict()
+_lists_lock = threading.Lock()
+
+
+def suppression_path(username):
+    return os.path.join(utils.FolderPath, f"{username}_suppression")
+
+
+def get_list(username):
+    with _lists_lock:
+        if username not in _lists:
+            _lists[username] = SuppressionList(suppression_path(username))
+        return _lists[username]
+
+
+def apply_keyword(username, number, body):
+    """
+    Opt `number` out of (or back into) `username`'s list when `body` is a
+    keyword. For the webhook: only the journal is appended to, the list
+    isn't loaded unless this process has it already.
+    """
+    action = keyword(body)
+    if action is None:
+        return None
+    with _lists_lock:
+        numbers = _lists.get(username)
+    if numbers is not None:
+        numbers._journal(action, number)
+    elif normalize_number(number) is not None:
+        append_journal(suppression_path(username) + ".log",
+                       [f"{action} {normalize_number(number)}\n"])
+    return action
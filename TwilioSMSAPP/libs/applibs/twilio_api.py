@@ -1,14 +1,152 @@
-from twilio.rest import Client
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-def twilio_send_msg(activerUser,message,phoneNumber):
-    account_sid = activerUser["account_sid"]
-    auth_token = activerUser["auth_token"]
-    client = Client(account_sid, auth_token)
+from libs.applibs import utils
+from libs.applibs.rate_limit import Limiter
 
+
+class ClientRegistry:
+    """
+    Keep one Twilio `Client` per (account_sid, auth_token) so every send
+    reuses the same keep-alive HTTP connection pool instead of doing a new
+    TLS handshake per message. Shared by the send thread and the Outbox.
+    Idle pools are closed by a background pruner every `idle_timeout`
+    seconds.
+    """
+
+    def __init__(self, pool_size=None, idle_timeout=None):
+        self.pool_size = pool_size or utils.ClientPoolSize
+        self.idle_timeout = idle_timeout or utils.ClientIdleTimeout
+        self._lock = threading.Lock()
+        self._clients = dict()
+        # counters of pools already closed by idle timeout
+        self._closed_opened = 0
+        self._closed_requests = 0
+        self._closed = threading.Event()
+        self._pruner = None
+
+    def get(self, account_sid, auth_token):
+        key = (account_sid, auth_token)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._clients.get(key)
+            if entry is None:
+                entry = self._clients[key] = self._new_entry(account_sid, auth_token)
+                self._start_pruner()
+            elif now - entry["last_used"] > self.idle_timeout:
+                # connections idle longer than this are likely dropped by
+                # the server, start a fresh pool instead of failing on them
+                self._close_pools(entry)
+            entry["last_used"] = now
+            return entry["client"]
+
+    def _new_entry(self, account_sid, auth_token):
+        # twilio.rest takes long to import, load it with the first send
+        # instead of at startup
+        from requests.adapters import HTTPAdapter
+        from twilio.http.http_client import TwilioHttpClient
+        from twilio.rest import Client
+
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        http_client = TwilioHttpClient(pool_connections=True)
+        http_client.session.mount("https://", adapter)
+        return {
+            "client": Client(account_sid, auth_token, http_client=http_client),
+            "adapter": adapter,
+            "last_used": time.monotonic(),
+        }
+
+    def _pool_counters(self, entry):
+        opened = requests = 0
+        pools = entry["adapter"].poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                opened += pool.num_connections
+                requests += pool.num_requests
+        return opened, requests
+
+    def _close_pools(self, entry):
+        opened, requests = self._pool_counters(entry)
+        self._closed_opened += opened
+        self._closed_requests += requests
+        entry["adapter"].close()
+
+    def _start_pruner(self):
+        if self._pruner is None:
+            self._pruner = threading.Thread(target=self._prune_loop,
+                                            name="client-pruner", daemon=True)
+            self._pruner.start()
+
+    def _prune_loop(self):
+        while not self._closed.wait(self.idle_timeout):
+            self.prune()
+
+    def prune(self):
+        """Close connection pools that have been idle past `idle_timeout`."""
+        now = time.monotonic()
+        with self._lock:
+            for entry in self._clients.values():
+                if now - entry["last_used"] > self.idle_timeout:
+                    self._close_pools(entry)
+
+    def close(self):
+        self._closed.set()
+        with self._lock:
+            for entry in self._clients.values():
+                self._close_pools(entry)
+            self._clients.clear()
+
+    def stats(self):
+        """Connections opened and reused across every pooled client."""
+        with self._lock:
+            opened = self._closed_opened
+            requests = self._closed_requests
+            for entry in self._clients.values():
+                o, r = self._pool_counters(entry)
+                opened += o
+                requests += r
+            return {
+                "clients": len(self._clients),
+                "pool_size": self.pool_size,
+                "idle_timeout": self.idle_timeout,
+                "connections_opened": opened,
+                "connections_reused": max(requests - opened, 0),
+                "requests": requests,
+            }
+
+
+Clients = ClientRegistry()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def submit(fn, *args):
+    """Run `fn(*args)` on the single send threads, return its Future."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=utils.SingleSendWorkers,
+                                           thread_name_prefix="single-send")
+    return _executor.submit(fn, *args)
+
+
+def twilio_send_msg(activerUser,message,phoneNumber,from_=None):
+    from_ = from_ or activerUser["phone_num"]
+    Limiter.acquire(activerUser["account_sid"], from_)
+    return create_message(activerUser,message,phoneNumber,from_)
+
+
+def create_message(activerUser,message,phoneNumber,from_):
+    """The bare API call, without waiting for the rate limiter."""
+    client = Clients.get(activerUser["account_sid"], activerUser["auth_token"])
     message = client.messages \
                     .create(
                         body=message,
-                        from_=activerUser["phone_num"],
+                        from_=from_,
                         to=phoneNumber,
                         status_callback=activerUser["server_url"]
                     )
@@ -1,5 +1,5 @@
-from kivy.lang import Builder
-import json,os
+import json,os,time
+from libs.applibs.startup import Profile
 
 
 ActiveUserData = dict()
@@ -7,12 +7,93 @@ ProgreassBarValue = int()
 SendMSGThread  = None
 ThreadExitEvent = False
 ServerThread = None
-StartReport = False
 UserDataFile = None 
+UserLogFile = None
+DeadLetterFile = None
 ReportDataFile = "C:\\Twilio\\report.json"
 AuthDataFile = "C:\\Twilio\\auth.json"
+StoreFile = "C:\\Twilio\\twilio.db"
 FolderPath = "C:\Twilio"
 
+# Status callback server. EmbeddedServer = False when it runs on its own
+# (`python server.py`) and the app should not start one
+ServerHost = "127.0.0.1"
+ServerPort = 5000
+ServerWorkers = 8
+EmbeddedServer = True
+# `/events` streams served at once, on threads of their own on top of the
+# workers, so status callbacks never wait behind a stream; more get a 503
+ServerEventStreams = 4
+
+# written at the first frame when TWILIO_PROFILE_STARTUP=1
+StartupReportFile = "C:\\Twilio\\startup_profile.json"
+
+# Twilio HTTP connection pool (per account) settings
+ClientPoolSize = 32
+ClientIdleTimeout = 60
+# threads sending the Outbox replies, off the UI thread
+SingleSendWorkers = 4
+
+# Twilio API requests kept in flight by the bulk sender: start value and
+# the bounds the adaptive (AIMD) controller moves it between
+SendConcurrency = 8
+SendConcurrencyMin = 1
+SendConcurrencyMax = 32
+# Controller window in seconds, decrease factor on 429/503 and the p95
+# latency (as a multiple of the best p50 seen) treated as overload
+AimdWindow = 1.0
+AimdBackoff = 0.5
+AimdLatencyTolerance = 2.0
+
+# Messages per second allowed per sending number and per account,
+# {key: (rate, burst)}; keys not listed use the defaults. 0 = no limit.
+SenderMPS = dict()
+AccountMPS = dict()
+DefaultSenderMPS = 4
+DefaultSenderBurst = 4
+DefaultAccountMPS = 0
+DefaultAccountBurst = 0
+
+# How the bulk sender spreads new recipients over a user's phone_pool:
+# "hash" (same sender for a number every time) or "least_loaded"
+SenderStrategy = "hash"
+
+# Send log batching: flush + fsync after this many records or seconds
+SendLogFlushEvery = 100
+SendLogFlushInterval = 1.0
+
+# Seconds between campaign checkpoints
+CheckpointInterval = 2.0
+
+# Retries of 429 / 5xx / network errors: attempts per number and
+# exponential backoff bounds in seconds
+RetryMaxAttempts = 5
+RetryBaseDelay = 1.0
+RetryMaxDelay = 60.0
+
+# Store writer batching: commit after this many events or seconds
+PersistBatchSize = 500
+PersistBatchInterval = 0.2
+# Events the writer may fall behind by before status callbacks get a 503
+PersistQueueSize = 20000
+
+# Seconds between looks at the opt-out journal while a campaign checks recipients
+SuppressionCheckInterval = 1.0
+
+# Seconds between checks for store changes made by another process (only
+# when the callback server runs on its own)
+CacheCheckInterval = 2.0
+# Latest conversations the report cache keeps in memory for the Outbox list
+ReportCacheSize = 20000
+
+# Messages per page when opening an Outbox conversation
+ThreadPageSize = 50
+ReportPageSize = 100
+
+# Home activity feed: entries kept, and seconds per frame spent adding them
+FeedSize = 500
+FeedFrameBudget = 0.004
+
 def read_json_file(Filename = AuthDataFile ):
     try:
         with open(Filename) as jsonFile:
@@ -35,5 +116,10 @@ def load_kv(file_name, file_path=os.path.join("libs", "uix", "kv")):
     Q: Why a custom `load_kv`?
     A: To avoid some encoding errors.
     """
+    # Imported here so the callback server can run without Kivy
+    from kivy.lang import Builder
+
+    started = time.perf_counter()
     with open(os.path.join(file_path, file_name), encoding="utf-8") as kv:
         Builder.load_string(kv.read())
+    Profile.record("kv", file_name, time.perf_counter() - started)
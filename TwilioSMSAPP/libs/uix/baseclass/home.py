@@ -6,12 +6,14 @@ from kivymd.uix.list import OneLineListItem
 from kivymd.uix.navigationdrawer import MDNavigationLayout
 from kivymd.uix.snackbar import Snackbar
 from kivy.clock import Clock
-from libs.applibs import utils,twilio_api
+from libs.applibs import utils,send_engine,sender_pool,send_log,campaign,retry,store,persistence,events,suppression
 from plyer import filechooser
 import threading
+import collections
+import time
+import os
 import datetime
 import json
-import time
 
 
 
@@ -20,21 +22,37 @@ utils.load_kv("home.kv")
 class Home_Screen(MDScreen):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.ListBox = list()
-        Clock.schedule_interval(self.update_on_clock, 0.5)
-        self.sleepThread = time.sleep
-
-    def update_on_clock(self,dt):
-        #print("Clock",dt) 
-        self.ids.progressbar.value = utils.ProgreassBarValue
-        # print(utils.ProgreassBarValue)
-        if len(self.ListBox) > 0:
-            listdata = self.ListBox[0]
-            self.ListBox.remove(listdata)
-            self.ids.container.add_widget(
-                        OneLineListItem(text=listdata)
-                    )
-        
+        # sent numbers not shown yet; when the sender is faster than the
+        # screen the oldest are dropped, they would scroll out anyway
+        self.ListBox = collections.deque(maxlen=utils.FeedSize)
+        self.engine = None
+        self.Progress = 0
+        self.SendStats = ""
+        # at most one repaint per frame, and only after something changed
+        self.repaint_trigger = Clock.create_trigger(self.repaint)
+        events.Bus.subscribe(events.PROGRESS, self.on_progress_event)
+
+    def on_progress_event(self, percent, stats):
+        self.Progress = percent
+        self.SendStats = stats
+        self.repaint_trigger()
+
+    def repaint(self, dt):
+        self.ids.progressbar.value = self.Progress
+        self.ids.send_stats.text = self.SendStats
+        if not self.ListBox:
+            return
+        # take what fits in this frame's budget, the rest next frame
+        rows = list()
+        deadline = time.perf_counter() + utils.FeedFrameBudget
+        while self.ListBox and time.perf_counter() < deadline:
+            rows.append({"text": self.ListBox.popleft()})
+        container = self.ids.container
+        container.data = (container.data + rows)[-utils.FeedSize:]
+        container.scroll_y = 0
+        if self.ListBox:
+            self.repaint_trigger()
+
 
     def file_manager_open(self):
         utils.ActiveUserData["server_url"]= self.ids.ser_url.text 
@@ -49,56 +67,81 @@ class Home_Screen(MDScreen):
         '''
         self.path = path
         self.ids.filenamefield.text = ", ".join(path)
-    def sendNuberList(self,msg_text):
-
-        Report= dict()
-        for selected_file in self.path:
-
-            with open(selected_file) as filedata:
-                NumFileData = set(filedata.readlines())
-                FileLen = len(NumFileData)
-                i = 0
-                
-                for number in NumFileData:
-                    i+=1
-                    number = str(number).removesuffix("\n")
-
-                    time = datetime.datetime.now()
-                    
-                    msgRespSid =  twilio_api.twilio_send_msg(utils.ActiveUserData,msg_text,number)
-                    Report = {
-                        "DateTime" : str(time),
-                        "TimeStamp" : time.timestamp(),
-                        "Number" : number,
-                        "Message" : msg_text,
-                        "SID" : msgRespSid
-                    }
-                    # print(number)
-                    if utils.ThreadExitEvent:
-                        exit()
-                    
-
-                    
-                    self.ListBox.append(number)
-                    utils.ProgreassBarValue = (i/FileLen)*100
-                    self.sleepThread(.25)
-
-                    
-                    
-        # print("Active USer",utils.ActiveUserData)
-        usrdatafile = utils.read_json_file(utils.UserDataFile)
-        if usrdatafile == 0 :
-            writeData = dict()
-            writeData[Report["SID"]] = Report
-            
-        else:
-            usrdatafile[Report["SID"]] = Report
-            writeData = usrdatafile
-            
-        utils.write_json_file(utils.UserDataFile,writeData)
-        # with open(utils.UserDataFile,"a") as jsonFile:
-        #     jsonFile.write(json.dumps(Report,indent=4))
-
+    def sendNuberList(self,Campaign):
+        msg_text = Campaign.message
+        Numbers = Campaign.reader()
+        SendLog = send_log.get_log(utils.UserLogFile)
+        Done = Campaign.data["sent"] + Campaign.data["failed"]
+
+        Store = store.get_store()
+        senders = sender_pool.SenderPool.for_user(
+            utils.ActiveUserData,
+            lambda number: Store.last_sender(utils.ActiveUserData["username"], number))
+        Persistence = persistence.get_service()
+        Suppressed = suppression.get_list(utils.ActiveUserData["username"])
+
+        def on_sent(number, msgRespSid, sender):
+            time = datetime.datetime.now()
+            Report = {
+                "DateTime" : str(time),
+                "TimeStamp" : time.timestamp(),
+                "Number" : number,
+                "From" : sender,
+                "Message" : msg_text,
+                "SID" : msgRespSid,
+                "Campaign" : Campaign.id
+            }
+            Persistence.add_message(Report, utils.ActiveUserData["username"])
+            SendLog.append(Report)
+            self.ListBox.append(number)
+            self.repaint_trigger()
+
+        DeadLetters = retry.DeadLetterStore(utils.DeadLetterFile)
+        def on_failed(number, error, attempts):
+            if retry.is_opted_out(error):
+                # replied STOP somewhere we did not see, never try again
+                Suppressed.add(number)
+            DeadLetters.add(number, msg_text, error, attempts, Campaign.id)
+
+        def on_progress(done, total):
+            events.Bus.publish(events.PROGRESS, min(((Done+done)/total)*100, 100),
+                               self.engine.controller.status())
+
+        def checkpoint(pending, summary):
+            Campaign.checkpoint(Numbers, pending, summary, SendLog.tell())
+
+        self.engine = engine = send_engine.SendEngine(
+            utils.ActiveUserData, msg_text, Campaign.recipients(Numbers, utils.UserLogFile),
+            total=Campaign.data["total"],
+            senders=senders,
+            on_sent=on_sent,
+            on_failed=on_failed,
+            on_progress=on_progress,
+            should_stop=lambda: utils.ThreadExitEvent or getattr(
+                threading.current_thread(), "killed", False),
+            checkpoint=checkpoint,
+            suppressed=Suppressed
+        )
+        if not Campaign.saved():
+            # makes it resumable. A resumed campaign keeps its checkpoint
+            # (in flight numbers, log offset) until the engine writes one
+            checkpoint(set(), engine.summary)
+        summary = engine.run()
+        Campaign.checkpoint(Numbers, engine.pending, summary, SendLog.tell(),
+                            status="stopped" if engine.stopped() else "done")
+        events.Bus.publish(events.PROGRESS, 100, engine.controller.status())
+        Clock.schedule_once(lambda dt: Snackbar(text=str(summary)).open())
+
+    def start_campaign(self, Campaign):
+        try:
+            utils.SendMSGThread.killed = True
+            utils.SendMSGThread.join()
+        except:
+            pass
+        finally:
+            utils.SendMSGThread = threading.Thread(target= self.sendNuberList,args=(Campaign,))
+
+        utils.SendMSGThread.start()
 
     def send_to_all(self):
         """Send sms to all phone numbers"""
@@ -110,17 +153,74 @@ class Home_Screen(MDScreen):
         else:
             utils.ActiveUserData["server_url"]= self.ids.ser_url.text 
             msg_text = self.ids.msg_field.text
-            try:
-                utils.SendMSGThread.killed = True
-                utils.SendMSGThread.join()
-            except:
-                pass
-            finally:
-                utils.SendMSGThread = threading.Thread(target= self.sendNuberList,args=(msg_text,))
-            
-            utils.SendMSGThread.start()
-
-        
+            self.start_campaign(campaign.Campaign.new(
+                utils.ActiveUserData["username"], msg_text, self.path,
+                server_url=self.ids.ser_url.text))
+
+    def import_opt_outs(self):
+        """Add the numbers of the chosen files to the opt-out list."""
+        filechooser.open_file(on_selection=self.select_opt_out_files,multiple=True)
+
+    def select_opt_out_files(self, paths):
+        if not paths:
+            return
+        Suppressed = suppression.get_list(utils.ActiveUserData["username"])
+        def import_files():
+            added = Suppressed.import_files(paths)
+            Clock.schedule_once(lambda dt: Snackbar(
+                text=f"{added} numbers opted out ({len(Suppressed)} in total).").open())
+        threading.Thread(target=import_files, daemon=True).start()
+
+    def retry_failed(self):
+        """
+        Queue the numbers that failed for good (dead letters) of the
+        message in the message box, or of the latest failed message, again.
+        """
+        DeadLetters = retry.DeadLetterStore(utils.DeadLetterFile)
+        records = DeadLetters.read()
+        if not records:
+            Snackbar(text= "No failed numbers.").open()
+            return
+        if len(self.ids.ser_url.text) <= 5:
+            Snackbar(text= "Server URL Problem.").open()
+            return
+        msg_text = self.ids.msg_field.text or records[-1]["Message"]
+        records = DeadLetters.take(msg_text)
+        if not records:
+            Snackbar(text= "No failed numbers for this message.").open()
+            return
+
+        os.makedirs(campaign.campaign_dir(), exist_ok=True)
+        path = os.path.join(campaign.campaign_dir(),
+            datetime.datetime.now().strftime("retry-%Y%m%d%H%M%S.txt"))
+        with open(path, "w") as filedata:
+            filedata.writelines(record["Number"] + "\n" for record in records)
+
+        self.path = [path]
+        self.ids.filenamefield.text = path
+        self.ids.msg_field.text = msg_text
+        utils.ActiveUserData["server_url"]= self.ids.ser_url.text
+        self.start_campaign(campaign.Campaign.new(
+            utils.ActiveUserData["username"], msg_text, self.path,
+            server_url=self.ids.ser_url.text))
+
+    def resume_campaign(self):
+        """Continue the latest stopped or crashed campaign."""
+        campaigns = campaign.Campaign.resumable(utils.ActiveUserData["username"])
+        if not campaigns:
+            Snackbar(text= "No campaign to resume.").open()
+            return
+        Campaign = campaigns[0]
+        if Campaign.changed_files():
+            Snackbar(text= "Numbers file changed, campaign can't resume.").open()
+            return
+        if len(self.ids.ser_url.text) > 5:
+            utils.ActiveUserData["server_url"] = self.ids.ser_url.text
+        else:
+            utils.ActiveUserData["server_url"] = Campaign.data["server_url"]
+        self.ids.msg_field.text = Campaign.message
+        self.ids.filenamefield.text = ", ".join(Campaign.paths)
+        self.start_campaign(Campaign)
 
 
     
@@ -128,13 +228,13 @@ class SideNavMenu(MDNavigationLayout):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.ListBox = list()
-        self.ClockRuning = Clock.schedule_interval(self.update_on_clock, 0.5)
-     
-    def update_on_clock(self,dt):
-        # print("Clock222",dt)
+        events.Bus.subscribe(events.LOGIN, self.on_login)
         if "username" in utils.ActiveUserData:
-            self.ids.nav_drawer_header.title = utils.ActiveUserData["username"] 
-            self.ClockRuning.cancel()
+            # built after the login (screens are built on first use)
+            self.on_login(utils.ActiveUserData["username"])
+     
+    def on_login(self, username):
+        Clock.schedule_once(lambda dt: setattr(self.ids.nav_drawer_header, "title", username))
         
 class ContentNavigationDrawer(MDBoxLayout):
     pass
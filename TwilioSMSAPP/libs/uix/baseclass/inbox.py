@@ -1,14 +1,84 @@
 from kivymd.uix.screen import MDScreen 
 from kivymd.uix.boxlayout import MDBoxLayout
 from kivymd.theming import ThemableBehavior
-from kivymd.uix.list import MDList
-from libs.applibs import utils
+from kivymd.uix.list import MDList,OneLineListItem,TwoLineListItem
+from kivy.clock import Clock
+from libs.applibs import utils,store,events
 
 utils.load_kv("inbox.kv")
 
 class Inbox_Screen(MDScreen):
-    pass
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.Username = None
+        self.ThreadCursor = None
+        self.ThreadItems = dict() # number key -> list item
+        self.MoreItem = None
+        self.Received = list()
+        # a reply storm is shown once per frame, not once per message
+        self.received_trigger = Clock.create_trigger(self.show_received)
+        events.Bus.subscribe(events.MESSAGE_RECEIVED, self.on_messages_received)
+
+    def on_pre_enter(self, *args):
+        username = utils.ActiveUserData.get("username")
+        if username != self.Username:
+            # new login, start the list over
+            self.ids.container.clear_widgets()
+            self.ThreadItems = dict()
+            self.ThreadCursor = None
+            self.MoreItem = None
+            self.Received = list()
+            self.Username = username
+            self.load_threads_page()
+
+    def load_threads_page(self, *args):
+        """Add the next page of conversations, by latest activity."""
+        threads, self.ThreadCursor = store.get_store().threads(
+            self.Username, limit=utils.ThreadPageSize, before=self.ThreadCursor,
+            inbound=True)
+        if self.MoreItem is not None:
+            self.ids.container.remove_widget(self.MoreItem)
+            self.MoreItem = None
+
+        for thread in threads:
+            key = store.number_key(thread["Number"])
+            if key not in self.ThreadItems:
+                # a thread that moved to the top since is already shown
+                self.ThreadItems[key] = self.thread_item(thread)
+                self.ids.container.add_widget(self.ThreadItems[key])
+
+        if self.ThreadCursor is not None:
+            self.MoreItem = OneLineListItem(text="Load more conversations",
+                                            on_press=self.load_threads_page)
+            self.ids.container.add_widget(self.MoreItem)
+
+    def thread_item(self, thread):
+        return TwoLineListItem(text=thread["Number"],
+                               secondary_text=thread["Message"] or "",
+                               on_press=self.open_thread)
+
+    def on_messages_received(self, messages):
+        self.Received.extend(messages)
+        self.received_trigger()
+
+    def show_received(self, dt):
+        Received, self.Received = self.Received, list()
+        if self.Username is None:
+            # not opened yet, the first page comes from the store
+            return
+        for data in sorted(Received, key=lambda data: data["TimeStamp"] or 0):
+            key = store.number_key(data["Number"])
+            if key in self.ThreadItems:
+                self.ids.container.remove_widget(self.ThreadItems[key])
+            self.ThreadItems[key] = self.thread_item(data)
+            self.ids.container.add_widget(self.ThreadItems[key],
+                                          index=len(self.ids.container.children))
+
+    def open_thread(self, item):
+        self.manager.change_screen("outbox")
+        self.manager.get_screen("outbox").open_thread(item.text)
+
 class ContentNavigationDrawer(MDBoxLayout):
     pass
 class DrawerList(ThemableBehavior, MDList):
-    pass
\ No newline at end of file
+    pass
@@ -1,6 +1,6 @@
 from kivymd.uix.screen import MDScreen
 from kivymd.uix.snackbar import Snackbar
-from libs.applibs import utils,authentication
+from libs.applibs import utils,authentication,store,events,report_cache
 
 utils.load_kv("login.kv")
 
@@ -9,8 +9,14 @@ class Login_Screen(MDScreen):
         msg= authentication.login(username.text,password.text)
         if msg[0]:
             utils.UserDataFile = f"C:\\Twilio\\{utils.ActiveUserData['username']}_report.json"
+            utils.UserLogFile = f"C:\\Twilio\\{utils.ActiveUserData['username']}_sendlog.jsonl"
+            utils.DeadLetterFile = f"C:\\Twilio\\{utils.ActiveUserData['username']}_deadletter.jsonl"
+            store.get_store().import_legacy(utils.ActiveUserData['username'])
+            # start the change notifications the screens listen to
+            report_cache.get_cache()
             Snackbar(text= msg[1]).open()
-            utils.StartReport = True
+            events.Bus.publish(events.LOGIN, utils.ActiveUserData['username'])
+            self.manager.prewarm()
         else:
             Snackbar(text= msg[1]).open()
         
@@ -6,7 +6,7 @@ from kivymd.uix.list import MDList,OneLineListItem
 from kivymd.uix.label import MDLabel
 from kivymd.uix.card import MDCard, MDSeparator
 from kivymd.uix.snackbar import Snackbar
-from libs.applibs import utils,twilio_api
+from libs.applibs import utils,twilio_api,send_log,persistence,report_cache,store,events
 from kivy.clock import Clock
 import datetime
 
@@ -16,43 +16,106 @@ class Outbox_Screen(MDScreen):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.INList = list()
-        self.ClockRunning = Clock.schedule_interval(self.update_outlist, 1)
+        self.INSet = set()
+        self.ListFilter = ""
         self.SelectedNumber = None
-        
-       
+        self.SelectedSender = None
+        self.Username = None
+        self.Generation = None
+        self.ThreadCursor = None
+        self.OlderItem = None
+        events.Bus.subscribe(events.MESSAGE_SENT, self.on_messages_sent)
+        events.Bus.subscribe(events.MESSAGE_RECEIVED, self.on_messages_received)
     
-    def on_list_press(self,event):
-        self.SelectedNumber = event.text
+    def open_thread(self, number):
+        self.SelectedNumber = number
+        self.SelectedSender = None
+        self.ThreadCursor = None
+        self.OlderItem = None
         self.ids.all_msgs.clear_widgets()
-        filedata = utils.read_json_file(utils.UserDataFile)
-        if filedata != 0:
-            for k in dict(filedata):
-                data = filedata[k]
-                if data["Number"] == event.text:
-                    self.send_msg(data["Message"],data["DateTime"],data["Number"])
-                else:
-                    continue
+        self.load_thread_page()
+
+    def load_thread_page(self, *args):
+        """Show the next older page of the selected conversation on top."""
+        messages, self.ThreadCursor = store.get_store().messages_for_number(
+            utils.ActiveUserData["username"], self.SelectedNumber,
+            limit=utils.ThreadPageSize, before=self.ThreadCursor)
+        if self.OlderItem is not None:
+            self.ids.all_msgs.remove_widget(self.OlderItem)
+            self.OlderItem = None
+
+        first_page = not self.ids.all_msgs.children
+        for data in reversed(messages):
+            self.send_msg(data["Message"],data["DateTime"],data["Number"],
+                          index=len(self.ids.all_msgs.children),
+                          direction=data.get("Direction"))
+        if first_page:
+            # keep replying from the number this contact knows
+            for data in reversed(messages):
+                if data.get("From"):
+                    self.SelectedSender = data["From"]
+                    break
+            if self.ids.all_msgs.children:
+                self.ids.msg_scroll_view.scroll_to(self.ids.all_msgs.children[0])
+
+        if self.ThreadCursor is not None:
+            self.OlderItem = OneLineListItem(text="Load older messages",
+                                             on_press=self.load_thread_page)
+            self.ids.all_msgs.add_widget(self.OlderItem,
+                                         index=len(self.ids.all_msgs.children))
         
     def filter_list(self,text):
-        self.ids.container.clear_widgets()
-        # print(text)    
-        for num in self.INList:
-            if text in num:
-                self.ids.container.add_widget(
-                    OneLineListItem(text=num,on_press=self.on_list_press)
-                )
-
-    def update_outlist(self,dt):
-        filedata = utils.read_json_file(Filename=utils.UserDataFile)
-        if filedata != 0:
-            for k in dict(filedata):
-                if filedata[k]["Number"] not in self.INList:
-                    # print(filedata[k]["Number"])
-                    self.ids.container.add_widget(
-                        OneLineListItem(text=filedata[k]["Number"],on_press=self.on_list_press)
-                    )
-
-                    self.INList.append(filedata[k]["Number"])
+        self.ListFilter = text
+        self.ids.container.data = [{"text": num} for num in self.INList if text in num]
+
+    def on_pre_enter(self, *args):
+        username = utils.ActiveUserData.get("username")
+        Cache = report_cache.get_cache()
+        if (username, Cache.generation) != (self.Username, self.Generation):
+            # new login or cleared store, start the list over
+            self.Username, self.Generation = username, Cache.generation
+            self.INList = [thread["Number"] for thread in Cache.threads()]
+            self.INSet = {store.number_key(number) for number in self.INList}
+            self.filter_list(self.ListFilter)
+
+    def on_messages_sent(self, messages):
+        if self.Username is not None:
+            Clock.schedule_once(lambda dt: self.update_outlist(messages))
+
+    def on_messages_received(self, messages):
+        Clock.schedule_once(lambda dt: self.show_received(messages))
+        if self.Username is not None:
+            Clock.schedule_once(lambda dt: self.update_outlist(messages))
+
+    def show_received(self, messages):
+        """Replies to the open conversation go at the bottom of it."""
+        if self.SelectedNumber is None:
+            return
+        key = store.number_key(self.SelectedNumber)
+        for data in messages:
+            if store.number_key(data["Number"]) == key:
+                self.send_msg(data["Message"],data["DateTime"],data["Number"],
+                              direction="inbound")
+
+    def update_outlist(self,reports):
+        """New conversations go on top, like the newest of `Store.threads`."""
+        new_numbers = list()
+        for data in reports:
+            key = store.number_key(data["Number"])
+            if key not in self.INSet:
+                self.INSet.add(key)
+                new_numbers.append(data["Number"])
+        if new_numbers:
+            new_numbers.reverse()
+            self.INList[:0] = new_numbers
+            # as many as the report cache keeps
+            for number in self.INList[utils.ReportCacheSize:]:
+                self.INSet.discard(store.number_key(number))
+            del self.INList[utils.ReportCacheSize:]
+            # one data change per batch, not one per number
+            self.ids.container.data = ([{"text": num} for num in new_numbers
+                                        if self.ListFilter in num] +
+                                       self.ids.container.data)[:utils.ReportCacheSize]
 
         
 
@@ -74,7 +137,10 @@ class Outbox_Screen(MDScreen):
             self.ids.send_card.size[1]=fixed_Y_size
 
     def click_send_msg(self,msg_data,server_url):
-        time = datetime.datetime.now()
+        """
+            Show the message at once as "sending…" and send it on a
+            background thread; the card turns sent/failed when done.
+        """
         if self.SelectedNumber == None:
             Snackbar(text= "Select Number from List").open()
         elif len(server_url) < 5:
@@ -82,32 +148,47 @@ class Outbox_Screen(MDScreen):
         else:
             time = datetime.datetime.now()
             utils.ActiveUserData["server_url"] = server_url
-            msgRespSid =twilio_api.twilio_send_msg(utils.ActiveUserData,msg_data,self.SelectedNumber)
-            # msgRespSid =  twilio_api.twilio_send_msg(utils.ActiveUserData,msg_text,number)
-            Report = {
-                "DateTime" : str(time),
-                "TimeStamp" : time.timestamp(),
-                "Number" : self.SelectedNumber,
-                "Message" : msg_data,
-                "SID" : msgRespSid
-            }
-            usrdatafile = utils.read_json_file(utils.UserDataFile)
-            if usrdatafile == 0 :
-                writeData = dict()
-                writeData[Report["SID"]] = Report
-                
-            else:
-                usrdatafile[Report["SID"]] = Report
-                writeData = usrdatafile
-                
-            utils.write_json_file(utils.UserDataFile,writeData)
-            self.send_msg(msg_data,str(time),self.SelectedNumber)
+            sender = self.SelectedSender or utils.ActiveUserData["phone_num"]
+            msg_card = self.send_msg(msg_data,str(time),self.SelectedNumber,status="sending…")
+            self.ids.msg_textbox.text=""
+
+            future = twilio_api.submit(self.deliver, dict(utils.ActiveUserData),
+                                       msg_data, self.SelectedNumber, sender, time,
+                                       utils.UserLogFile)
+            future.add_done_callback(
+                lambda future: Clock.schedule_once(lambda dt: self.show_sent(msg_card, future)))
+
+    def deliver(self, user, msg_data, number, sender, time, log_file):
+        """Send thread: the API call and the write to the log and store."""
+        msgRespSid = twilio_api.twilio_send_msg(user,msg_data,number,sender)
+        Report = {
+            "DateTime" : str(time),
+            "TimeStamp" : time.timestamp(),
+            "Number" : number,
+            "From" : sender,
+            "Message" : msg_data,
+            "SID" : msgRespSid
+        }
+        persistence.get_service().add_message(Report, user["username"])
+        send_log.get_log(log_file).append(Report)
+        return msgRespSid
+
+    def show_sent(self, msg_card, future):
+        error = future.exception()
+        if error is None:
+            msg_card.status_label.text = "sent"
+        else:
+            msg_card.status_label.text = "failed"
+            msg_card.status_label.theme_text_color = "Error"
+            Snackbar(text= f"Send failed: {getattr(error, 'msg', None) or error}").open()
     
 
-    def send_msg(self,msg_data,time_data,number_data):
+    def send_msg(self,msg_data,time_data,number_data,index=None,direction=None,status=None):
         """
-            When send button use to send msg this function call
-            and clear MSGbox 
+            Add a message card to the conversation and return it. With
+            `index` the card is put at that position (older messages)
+            instead of at the bottom. Inbound messages get a "From"
+            header; with `status` the card shows it in `status_label`.
         """
         
         text_msg = MDLabel(text=msg_data,halign="left")
@@ -127,11 +208,11 @@ class Outbox_Screen(MDScreen):
             padding=20,
             elevation=9,
             ripple_behavior= True,
-            radius= [25,25,25,0 ]
+            radius= [25,25,0,25] if direction == "inbound" else [25,25,25,0 ]
 
         )
         msg_card.add_widget(MDLabel(
-            text= f"To :> {number_data} {' '*4} Date&Time :> {time_data}",
+            text= f"{'From' if direction == 'inbound' else 'To'} :> {number_data} {' '*4} Date&Time :> {time_data}",
             theme_text_color= "Secondary",
             size_hint_y= None,
             height= 50
@@ -141,11 +222,26 @@ class Outbox_Screen(MDScreen):
         ))
 
         msg_card.add_widget(text_msg)
+        if status is not None:
+            msg_card.status_label = MDLabel(
+                text= status,
+                theme_text_color= "Secondary",
+                halign= "right",
+                size_hint_y= None,
+                height= 30
+            )
+            msg_card.add_widget(msg_card.status_label)
+        if index is not None:
+            self.ids.all_msgs.add_widget(msg_card, index=index)
+            return msg_card
         self.ids.all_msgs.add_widget(msg_card)
         # print(msg_data)
         self.ids.msg_scroll_view.scroll_to(msg_card)
-        self.ids.msg_textbox.text=""
+        return msg_card
     pass
+class NumberListItem(OneLineListItem):
+    """Row of the Outbox number list, reused by the RecycleView."""
+
 class ContentNavigationDrawer(MDBoxLayout):
     pass
 class DrawerList(ThemableBehavior, MDList):
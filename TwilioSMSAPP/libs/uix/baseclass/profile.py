@@ -2,17 +2,22 @@ from kivymd.uix.dialog import MDDialog
 from kivymd.uix.button import MDFlatButton
 from kivymd.uix.bottomsheet import MDGridBottomSheet
 from kivymd.uix.screen import MDScreen
+from kivymd.uix.snackbar import Snackbar
 from libs.uix.baseclass.ui_class import OneLineTextDialog
 
-from libs.applibs import utils
+from libs.applibs import utils,authentication
 
 utils.load_kv("profile.kv")
 
 class Profile_Screen(MDScreen):
-    
-    def change_profile_data(self,widget):
+
+    def on_pre_enter(self, *args):
+        self.ids.profile_senders.text = ", ".join(
+            utils.ActiveUserData.get("phone_pool") or [utils.ActiveUserData.get("phone_num", "")])
+
+    def change_profile_data(self,widget,on_ok=None):
         """Change text data using Dialog box.
-        [widget] change this widget text"""
+        [widget] change this widget text, or hand the text to [on_ok]"""
         dialogObj =None
         Dialog=OneLineTextDialog()
         def cancel_btn(btn):
@@ -20,7 +25,10 @@ class Profile_Screen(MDScreen):
             dialogObj.dismiss(force=True)
         def ok_btn(btn):
             # use function when OK btn click
-            widget.text = Dialog.ids.dialog_text.text
+            if on_ok is not None:
+                on_ok(Dialog.ids.dialog_text.text)
+            else:
+                widget.text = Dialog.ids.dialog_text.text
             cancel_btn(btn)
             
             
@@ -46,6 +54,16 @@ class Profile_Screen(MDScreen):
         dialogObj.open()
         
     
+    def add_sender_numbers(self,widget):
+        """Add comma separated numbers to the bulk sender's phone pool."""
+        def save(numbers):
+            ok,msg = authentication.add_sender_numbers(
+                utils.ActiveUserData["username"], numbers)
+            if ok:
+                widget.text = ", ".join(utils.ActiveUserData["phone_pool"])
+            Snackbar(text=msg).open()
+        self.change_profile_data(widget,on_ok=save)
+
     def change_profile_img(self):
         """
         method call when image click on profile_view page.
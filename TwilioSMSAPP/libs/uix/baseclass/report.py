@@ -7,22 +7,72 @@ from kivymd.uix.list import MDList
 from kivymd.uix.datatables import MDDataTable
 from kivy.metrics import dp
 from kivy.clock import Clock
-from libs.applibs import utils
+from kivymd.uix.snackbar import Snackbar
+from libs.applibs import utils,send_log,store,report_cache,events
+import datetime
 import json
 utils.load_kv("report.kv")
 
 class Report_Screen(MDScreen):
-    
-    
+    """
+    Latest status of every message, one page at a time from the store.
+    The table is built when the screen is first opened; after that,
+    "More" appends the next older page and entering the screen (or a
+    status change while it is shown) updates the rows that changed in
+    place, instead of building the table again. Messages newer than the
+    table can't go on top without a rebuild, so they only light up the
+    Reload button.
+    """
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
+        self.data_tables = None
+        self.Username = None
+        self.Filters = dict()
+        self.Cursor = None
+        self.Newest = None
+        self.Shown = dict() # MessageSid -> row
+        self.arrived_trigger = Clock.create_trigger(self.show_arrived)
+        events.Bus.subscribe(events.STATUS_CHANGED, self.on_status_changed)
 
-        self.load_data_table()
-        
-        # self.ClockRunning = Clock.schedule_interval(self.update_on_clock, 5)
+    def on_pre_enter(self, *args):
+        username = utils.ActiveUserData.get("username")
+        if self.data_tables is None or username != self.Username:
+            self.Username = username
+            self.load_data_table()
+        else:
+            self.show_arrived()
+
+    def read_filters(self):
+        """Filters typed above the table -> `Store.report_page` arguments"""
+        Filters = {
+            "status": self.ids.status_filter.text.strip().lower() or None,
+            "number": self.ids.number_filter.text.strip() or None,
+        }
+        for key, field, days in (("since", self.ids.since_filter, 0),
+                                 ("until", self.ids.until_filter, 1)):
+            text = field.text.strip()
+            if not text:
+                continue
+            try:
+                day = datetime.datetime.strptime(text, "%Y-%m-%d")
+            except ValueError:
+                Snackbar(text= "Dates as YYYY-MM-DD.").open()
+                return None
+            # the until day is included
+            Filters[key] = (day + datetime.timedelta(days=days)).timestamp()
+        return Filters
 
-    
     def load_data_table(self):
+        Filters = self.read_filters()
+        if Filters is None:
+            return
+        self.Filters = Filters
+        self.Cursor = None
+        self.Newest = None
+        self.Shown = dict()
+        self.ids.reload_button.text = "Reload..."
+        self.ids.data_table.clear_widgets()
         self.data_tables = MDDataTable(
             size_hint=(1, 1),
             pos_hint= {"center_x":0.5, "center_y":0.5},
@@ -44,56 +94,85 @@ class Report_Screen(MDScreen):
         self.ids.data_table.add_widget(self.data_tables)
    
     def clear_report(self):
-        os.remove(utils.ReportDataFile)
-        os.remove(utils.UserDataFile)
+        if utils.SendMSGThread is not None and utils.SendMSGThread.is_alive():
+            # the campaign writes to the send log and checkpoints its offset
+            Snackbar(text= "Stop the running campaign before clearing.").open()
+            return
+        store.get_store().clear(utils.ActiveUserData["username"])
+        report_cache.get_cache().invalidate()
+        for datafile in (utils.ReportDataFile, utils.UserDataFile):
+            if os.path.exists(datafile + ".imported"):
+                os.remove(datafile + ".imported")
+        send_log.close_log(utils.UserLogFile)
+        if os.path.exists(utils.UserLogFile):
+            os.remove(utils.UserLogFile)
+        self.load_data_table()
         
     def load_data_row(self):
-        # allData = dict()
-        # with open(utils.UserDataFile) as userdata:
-        #     with open(utils.ReportDataFile) as reportdata:
-        #         udata = json.load(userdata)
-        #         for 
-        reportData = utils.read_json_file(Filename=utils.ReportDataFile)
-        num = int()
-        if reportData != 0:
-            for key_data,val_data in list(dict(reportData).items())[::-1]:
-                num +=1
-                smsStatusIcon = None
-                if dict(val_data).get("SmsStatus") == "delivered":
-                    smsStatusIcon= "checkbox-marked-circle",[39 / 256, 174 / 256, 96 / 256, 1]
-                elif dict(val_data).get("SmsStatus") == "sent":
-                    smsStatusIcon= "alert", [255 / 256, 165 / 256, 0, 1]
-                else:
-                    smsStatusIcon= "alert-circle", [1, 0, 0, 1]
+        """Add the next (older) page to the table."""
+        reports, self.Cursor = store.get_store().report_page(
+            self.Username, limit=utils.ReportPageSize, after=self.Cursor, **self.Filters)
+        if self.Newest is None:
+            self.Newest = ((reports[0]["TimeStamp"], reports[0]["MessageSid"])
+                           if reports else (0, ""))
+        rows = list()
+        for val_data in reports:
+            if val_data["MessageSid"] not in self.Shown:
+                row = self.report_row(val_data, len(self.Shown) + 1)
+                self.Shown[val_data["MessageSid"]] = row
+                rows.append(row)
+        if not self.data_tables.row_data:
+            self.data_tables.row_data = rows
+        else:
+            # older rows go at the bottom, the rows shown stay as they are
+            for row in rows:
+                self.data_tables.add_row(row)
+        self.ids.more_button.disabled = self.Cursor is None
 
+    def on_status_changed(self, statuses):
+        if self.data_tables is not None and self.manager is not None and (
+                self.manager.current == self.name):
+            self.arrived_trigger()
 
-                data = (
-                            str(num),
-                            # dict(val_data).get("SmsStatus"),
-                            (smsStatusIcon[0], smsStatusIcon[1], dict(val_data).get("SmsStatus")),
-                            dict(val_data).get("To"),
-                            dict(val_data).get("From"),
-                            dict(val_data).get("MessageSid"),
-                            dict(val_data).get("DateTime"),
-                            dict(val_data).get("AccountSid")
-                        )
+    def show_arrived(self, *args):
+        """Update the rows whose status changed since they were read, flag new ones."""
+        reports, cursor = store.get_store().report_page(
+            self.Username, limit=utils.ReportPageSize, after=self.Newest,
+            newest_first=False, **self.Filters)
+        for val_data in reports:
+            old = self.Shown.get(val_data["MessageSid"])
+            if old is None:
+                # belongs above the first row: shown after a Reload
+                self.ids.reload_button.text = "Reload (new)"
+            else:
+                row = self.report_row(val_data, int(old[0]))
+                self.data_tables.update_row(old, row)
+                self.Shown[val_data["MessageSid"]] = row
+        if reports:
+            self.Newest = (reports[-1]["TimeStamp"], reports[-1]["MessageSid"])
+        if cursor is not None:
+            # more than a page changed, the rest next frame
+            self.arrived_trigger()
 
-                self.data_tables.row_data.append(data)
-        
+    def report_row(self, val_data, num):
+        if dict(val_data).get("SmsStatus") == "delivered":
+            smsStatusIcon= "checkbox-marked-circle",[39 / 256, 174 / 256, 96 / 256, 1]
+        elif dict(val_data).get("SmsStatus") == "sent":
+            smsStatusIcon= "alert", [255 / 256, 165 / 256, 0, 1]
+        else:
+            smsStatusIcon= "alert-circle", [1, 0, 0, 1]
 
+        return (
+                    str(num),
+                    # dict(val_data).get("SmsStatus"),
+                    (smsStatusIcon[0], smsStatusIcon[1], dict(val_data).get("SmsStatus")),
+                    dict(val_data).get("To"),
+                    dict(val_data).get("From"),
+                    dict(val_data).get("MessageSid"),
+                    dict(val_data).get("DateTime"),
+                    dict(val_data).get("AccountSid")
+                )
 
-        
-        
-    def update_on_clock(self,dt):
-        # print("Not Report")
-        if utils.StartReport:
-            # print("-----------YEs Report")
-            self.load_data_row()
-            utils.StartReport = False
-            
-            self.ClockRunning.cancel()
-
-        
 
 class ContentNavigationDrawer(MDBoxLayout):
     pass
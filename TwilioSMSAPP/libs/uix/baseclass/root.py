@@ -1,18 +1,86 @@
 from kivy.core.window import Window
 
+from kivy.clock import Clock
+from kivy.logger import Logger
 from kivy.uix.screenmanager import ScreenManager
 from kivymd.uix.button import MDFlatButton
 from kivymd.uix.dialog import MDDialog
 from libs.applibs import utils
+from libs.applibs.startup import Profile
+import importlib
+import time
 
 utils.load_kv("root.kv")
 
+# screen name -> (module, class). A screen's module (and with it its kv
+# file) is imported and the screen built the first time it is shown.
+SCREENS = {
+    "login": ("libs.uix.baseclass.login", "Login_Screen"),
+    "signup": ("libs.uix.baseclass.signup", "Signup_Screen"),
+    "forgot": ("libs.uix.baseclass.forgot", "Forgot_Screen"),
+    "verification": ("libs.uix.baseclass.verification", "Verification_Screen"),
+    "home": ("libs.uix.baseclass.home", "Home_Screen"),
+    "chat_room": ("libs.uix.baseclass.chat_room", "Chat_Room_Screen"),
+    "profile": ("libs.uix.baseclass.profile", "Profile_Screen"),
+    "outbox": ("libs.uix.baseclass.outbox", "Outbox_Screen"),
+    "inbox": ("libs.uix.baseclass.inbox", "Inbox_Screen"),
+    "report": ("libs.uix.baseclass.report", "Report_Screen"),
+}
+
+# modules whose kv rules a screen uses (SideNavMenu lives in home)
+SCREEN_NEEDS = {
+    "outbox": ["libs.uix.baseclass.home"],
+    "inbox": ["libs.uix.baseclass.home"],
+    "report": ["libs.uix.baseclass.home"],
+}
+
+# built one per frame after login, so they open at once later
+PREWARM_SCREENS = ["home", "outbox", "inbox", "report"]
+
 class Root(ScreenManager):
     def __init__(self, **kwargs):
         super(Root, self).__init__(**kwargs)
         Window.bind(on_keyboard=self._key_handler)
         self.screen_list = list() #this list have all screen that user switched
         self.dialog = None
+        self.load_times = dict() # screen name -> (import + kv, build) seconds
+        self._prewarm = list()
+
+    def get_screen(self, name):
+        if name in SCREENS and name not in self.screen_names:
+            self.load_screen(name)
+        return super(Root, self).get_screen(name)
+
+    def load_screen(self, name):
+        """Import the screen's module (loads its kv) and add the screen."""
+        module_name, class_name = SCREENS[name]
+        started = time.perf_counter()
+        for needed in SCREEN_NEEDS.get(name, ()):
+            importlib.import_module(needed)
+        screen_class = getattr(importlib.import_module(module_name), class_name)
+        imported = time.perf_counter()
+        self.add_widget(screen_class())
+        built = time.perf_counter()
+        self.load_times[name] = (imported - started, built - imported)
+        Profile.record("screens", name, built - imported)
+        Logger.info(f"Root: screen {name} loaded in {(imported - started) * 1000:.1f} ms, "
+                    f"built in {(built - imported) * 1000:.1f} ms")
+
+    def prewarm(self, names=None):
+        """Build the screens not shown yet in the background, one per frame."""
+        self._prewarm = [name for name in (names or PREWARM_SCREENS)
+                         if name not in self.screen_names]
+        if self._prewarm:
+            Clock.schedule_once(self._prewarm_next)
+
+    def _prewarm_next(self, dt):
+        while self._prewarm:
+            name = self._prewarm.pop(0)
+            if name not in self.screen_names:
+                self.load_screen(name)
+                break
+        if self._prewarm:
+            Clock.schedule_once(self._prewarm_next)
     
     def _key_handler(self, instance, key, *args):
         
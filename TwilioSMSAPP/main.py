@@ -6,29 +6,43 @@ Made in India Software
 
 
 """
-from threading import Thread
-from server import TwilioAppServer
-global AppServer
-AppServer = Thread(target=TwilioAppServer)
-AppServer.start()
-
-from kivy.core.window import Window
-Window.maximize()
-
-from libs.uix.baseclass.chat_room import Chat_Room_Screen
-from libs.uix.baseclass.forgot import Forgot_Screen
-from libs.uix.baseclass.home import Home_Screen
-from libs.uix.baseclass.login import Login_Screen
-from libs.uix.baseclass.profile import Profile_Screen
-from libs.uix.baseclass.root import Root
-from libs.uix.baseclass.signup import Signup_Screen
-from libs.uix.baseclass.verification import Verification_Screen
-from libs.uix.baseclass.outbox import Outbox_Screen
-from libs.uix.baseclass.inbox import Inbox_Screen
-from libs.uix.baseclass.report import Report_Screen
-
-from kivymd.app import MDApp
-from libs.applibs import utils
+import time
+STARTED = time.perf_counter()
+
+from libs.applibs import startup
+if startup.ENABLED:
+    startup.Profile.install_import_hook()
+startup.Profile.started = STARTED
+
+with startup.Profile.phase("server start"):
+    from threading import Thread
+    from libs.applibs import utils,events
+
+    def run_server():
+        # flask is imported here, off the startup path
+        import server
+        server.TwilioAppServer()
+
+    global AppServer
+    AppServer = None
+    if utils.EmbeddedServer:
+        AppServer = Thread(target=run_server, daemon=True)
+        AppServer.start()
+    else:
+        # repaint when the separate callback server commits
+        events.EventStream(f"http://{utils.ServerHost}:{utils.ServerPort}/events").start()
+
+with startup.Profile.phase("imports"):
+    from kivy.core.window import Window
+    Window.maximize()
+
+    # the screens are imported and built by Root when first shown
+    from libs.uix.baseclass.root import Root
+
+    from kivymd.app import MDApp
+    from kivy.clock import Clock
+    from kivy.logger import Logger
+    from libs.applibs import utils,send_log,persistence
 import os
 class TwilioSMSApp(MDApp):
     """
@@ -71,37 +85,40 @@ class TwilioSMSApp(MDApp):
 
         self.theme_cls.theme_style = "Light"
     
-        self.screen_manager = Root()
-        self.screen_manager.add_widget(Login_Screen())
-        self.screen_manager.add_widget(Signup_Screen())
-        self.screen_manager.add_widget(Forgot_Screen())
-        self.screen_manager.add_widget(Verification_Screen())
-        self.screen_manager.add_widget(Home_Screen())
-        self.screen_manager.add_widget(Chat_Room_Screen())
-        self.screen_manager.add_widget(Profile_Screen())
-        self.screen_manager.add_widget(Outbox_Screen())
-        self.screen_manager.add_widget(Inbox_Screen())
-        self.screen_manager.add_widget(Report_Screen())
-
-
+        with startup.Profile.phase("build"):
+            self.screen_manager = Root()
         return self.screen_manager
     
     def on_start(self):
         """
         Anything we want to run when start application that code is here.
         """
+        self.first_frame_started = time.perf_counter()
         self.screen_manager.change_screen("login")
+        Clock.schedule_once(self.first_frame)
         # self.all_chats()
+
+    def first_frame(self, dt):
+        startup.Profile.add_phase("first frame", time.perf_counter() - self.first_frame_started)
+        Logger.info(f"Startup: login shown {time.perf_counter() - STARTED:.3f}s after launch")
+        if startup.ENABLED:
+            startup.Profile.remove_import_hook()
+            startup.Profile.write_report(utils.StartupReportFile)
+            Logger.info(f"Startup: profile written to {utils.StartupReportFile}")
     def on_stop(self):
         if utils.SendMSGThread != None:
             utils.SendMSGThread.killed = True
             utils.SendMSGThread.join()
 
-            global AppServer
-            AppServer.killed = True
-            AppServer.join()
-            AppServer.killed = True
-            AppServer.join()
+        global AppServer
+        if AppServer is not None:
+            import server
+            server.stop_server()
+            AppServer.join(timeout=5)
+
+        if utils.UserLogFile is not None:
+            send_log.close_log(utils.UserLogFile)
+        persistence.stop_service()
     
 
 
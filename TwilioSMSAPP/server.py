@@ -1,33 +1,239 @@
-from flask import Flask, request
-from libs.applibs import utils
+from flask import Flask, Response, request, jsonify, g
+from libs.applibs import utils, persistence, events, authentication, suppression, twilio_api
+from libs.applibs.store import get_store
+from concurrent.futures import ThreadPoolExecutor
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import make_server, WSGIServer, WSGIRequestHandler
+import argparse
 import datetime
+import os
+import threading
+import time
 
-def TwilioAppServer():
+try:
+    import waitress
+except ImportError:
+    waitress = None
+
+
+class RequestMetrics:
+    """Request counts and handling time of the callback server."""
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.histogram = [0] * (len(self.BUCKETS) + 1)
+
+    def observe(self, seconds, status):
+        with self._lock:
+            self.requests += 1
+            if status >= 400:
+                self.errors += 1
+            self.total_time += seconds
+            self.max_time = max(self.max_time, seconds)
+            for i, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    self.histogram[i] += 1
+                    break
+            else:
+                self.histogram[-1] += 1
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "avg_ms": round(self.total_time / self.requests * 1000, 3) if self.requests else 0,
+                "max_ms": round(self.max_time * 1000, 3),
+                "histogram_ms": {
+                    **{f"<={int(bound * 1000)}": count
+                       for bound, count in zip(self.BUCKETS, self.histogram)},
+                    f">{int(self.BUCKETS[-1] * 1000)}": self.histogram[-1],
+                },
+            }
+
+
+Metrics = RequestMetrics()
+
+
+EMPTY_TWIML = '<?xml version="1.0" encoding="UTF-8"?><Response></Response>'
+
+
+def create_app():
     app = Flask(__name__)
+
+    @app.before_request
+    def start_timer():
+        g.started = time.perf_counter()
+
+    @app.after_request
+    def record_time(response):
+        Metrics.observe(time.perf_counter() - g.started, response.status_code)
+        return response
+
     #, methods=['POST']
     @app.route('/', methods=['POST'])
     def result():
         Report = dict(request.form)
+        if not Report.get("MessageSid") or not (Report.get("MessageStatus") or Report.get("SmsStatus")):
+            return 'Missing MessageSid or MessageStatus', 400
         time = datetime.datetime.now()
 
         Report["DateTime"] = str(time)
         Report["TimeStamp"] = time.timestamp()
-        
-        reportdatafile = utils.read_json_file(utils.ReportDataFile)
-        if reportdatafile == 0 :
-            writeData = dict()
-            writeData[Report["MessageSid"]] = Report
-            
-        else:
-            reportdatafile[Report["MessageSid"]] = Report
-            writeData = reportdatafile
-        
-        utils.write_json_file(utils.ReportDataFile,writeData)
+
+        try:
+            persistence.get_service().add_status(Report)
+        except persistence.Overloaded:
+            return 'Busy, retry later', 503, {"Retry-After": "1"}
 
         return 'Received !' # response to your request.
 
-    app.run(port=5000)
+    @app.route('/sms', methods=['POST'])
+    def inbound():
+        """Twilio "A message comes in" webhook."""
+        form = request.form
+        sid = form.get("MessageSid") or form.get("SmsSid")
+        if not sid or not form.get("From"):
+            return 'Missing MessageSid or From', 400
+        time = datetime.datetime.now()
+        Report = {
+            "SID" : sid,
+            "Direction" : "inbound",
+            "Number" : form["From"],
+            "From" : form.get("To"), # our number, replies go out from it
+            "AccountSid" : form.get("AccountSid"),
+            "Message" : form.get("Body", ""),
+            "DateTime" : str(time),
+            "TimeStamp" : time.timestamp()
+        }
+        username = authentication.owner_of(form.get("To"), form.get("AccountSid"))
+
+        try:
+            persistence.get_service().add_message(Report, username, block=False)
+        except persistence.Overloaded:
+            return 'Busy, retry later', 503, {"Retry-After": "1"}
+        if username is not None:
+            suppression.apply_keyword(username, form["From"], Report["Message"])
+
+        # empty TwiML: no automatic reply
+        return EMPTY_TWIML, 200, {"Content-Type": "text/xml"}
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return jsonify(requests=Metrics.as_dict(), ingest=persistence.get_service().stats(),
+                       delivery=get_store().delivery_latency(),
+                       clients=twilio_api.Clients.stats())
+
+    @app.route('/events', methods=['GET'])
+    def event_stream():
+        # lets an app running in another process repaint as soon as we commit
+        with _streams_lock:
+            if len(_streams) >= utils.ServerEventStreams:
+                return 'Too many event streams', 503, {"Retry-After": "5"}
+            queue = events.EventQueue([events.COMMITTED])
+            _streams.add(queue)
+
+        def stream():
+            try:
+                yield from events.sse_stream(queue)
+            finally:
+                with _streams_lock:
+                    _streams.discard(queue)
+
+        return Response(stream(),
+                        mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache"})
+
+    return app
+
+
+class PooledWSGIServer(ThreadingMixIn, WSGIServer):
+    """wsgiref server handling requests on a fixed pool of worker threads."""
+
+    def __init__(self, *args, workers=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = ThreadPoolExecutor(max_workers=workers or utils.ServerWorkers,
+                                       thread_name_prefix="callback")
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=False)
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_streams = set()
+_streams_lock = threading.Lock()
+
+
+def TwilioAppServer(host=None, port=None, workers=None):
+    """
+    Serve the status callbacks until `stop_server()`. Uses waitress when
+    it is installed, otherwise a pooled wsgiref server; both handle
+    requests on `workers` threads, plus one per allowed `/events` stream
+    (a stream keeps its thread while the client is connected).
+    """
+    global _server
+    host = host or utils.ServerHost
+    port = port or utils.ServerPort
+    workers = (workers or utils.ServerWorkers) + utils.ServerEventStreams
+    app = create_app()
+
+    if waitress is not None:
+        _server = waitress.create_server(app, host=host, port=port, threads=workers)
+        _server.run()
+    else:
+        _server = make_server(host, port, app,
+                              server_class=lambda *args, **kwargs: PooledWSGIServer(
+                                  *args, workers=workers, **kwargs),
+                              handler_class=QuietHandler)
+        _server.serve_forever()
+
+
+def stop_server():
+    with _streams_lock:
+        streams = list(_streams)
+        _streams.clear()
+    for queue in streams:
+        queue.close()
+    if _server is None:
+        return
+    if waitress is not None:
+        _server.close()
+    else:
+        _server.shutdown()
+        _server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Twilio status callback server")
+    parser.add_argument("--host", default=utils.ServerHost)
+    parser.add_argument("--port", type=int, default=utils.ServerPort)
+    parser.add_argument("--workers", type=int, default=utils.ServerWorkers)
+    parser.add_argument("--event-streams", type=int, default=utils.ServerEventStreams)
+    args = parser.parse_args()
+    utils.ServerEventStreams = args.event_streams
+
+    os.makedirs(utils.FolderPath, exist_ok=True)
+    print(f"Callback server on http://{args.host}:{args.port} ({args.workers} workers)")
+    try:
+        TwilioAppServer(args.host, args.port, args.workers)
+    finally:
+        persistence.stop_service()
 
 
 if __name__ == "__main__":
-    TwilioAppServer()
\ No newline at end of file
+    main()